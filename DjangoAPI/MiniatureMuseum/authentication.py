@@ -0,0 +1,29 @@
+from rest_framework.authentication import BaseAuthentication
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+
+
+GUEST_ID_HEADER = 'X-Guest-Id'
+
+
+class GuestAuthentication(BaseAuthentication):
+    """
+    X-Guest-Id ヘッダを dispatch 時に1回だけ読み、request.guest_id に載せる。
+    ユーザーとしては認証しない（常に None を返し、後続の認証に任せる）。
+    将来署名付きトークンに差し替える場合はここだけ変える。
+    """
+
+    def authenticate(self, request):
+        request.guest_id = request.headers.get(GUEST_ID_HEADER) or None
+        return None
+
+
+class GuestAuthenticationScheme(OpenApiAuthenticationExtension):
+    target_class = 'MiniatureMuseum.authentication.GuestAuthentication'
+    name = 'guestId'
+
+    def get_security_definition(self, auto_schema):
+        return {
+            'type': 'apiKey',
+            'in': 'header',
+            'name': GUEST_ID_HEADER,
+        }
@@ -1,33 +1,26 @@
 
 # Create your models here.
 import uuid
+from django.core.validators import MaxValueValidator
 from django.db import models
-from django.utils import timezone
 #from core.models import User
+from core.models import BaseModel as CoreBaseModel
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
 # -----------------------------------------------------------------------------
 # 0. 共通 Abstract Model
 # -----------------------------------------------------------------------------
 
-class BaseModel(models.Model):
+class BaseModel(CoreBaseModel):
     """
-    全モデル共通の基底クラス
-    UUIDプライマリキーと監査ログ用フィールドを持つ
+    core.BaseModel と同じ論理削除（instance.delete() / QuerySet.soft_delete()）と
+    schema_version の CHECK 制約を使う。主キーだけは従来どおり UUIDv4
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    schema_version = models.PositiveIntegerField(default=1)  # マイグレーション用
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-    deleted_at = models.DateTimeField(null=True, blank=True)  # 論理削除用
 
-    class Meta:
+    class Meta(CoreBaseModel.Meta):
         abstract = True
 
-    def delete(self, using=None, keep_parents=False):
-        """論理削除の実装"""
-        self.deleted_at = timezone.now()
-        self.save()
-
 
 # -----------------------------------------------------------------------------
 # 7. Digital Miniature Museum (Gallery / Exhibit)
@@ -64,15 +57,21 @@ class Gallery(BaseModel):
     # 一覧用サムネ（S3 URL）
     cover_render_url = models.URLField(max_length=2048, null=True, blank=True)
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'galleries'
         indexes = [
             models.Index(fields=['user_style', 'created_at']),
             models.Index(fields=['owner', 'created_at']),
             models.Index(fields=['guest_id', 'created_at']),
             models.Index(fields=['slug']),
+            # 公開ビューア（slug 引き）用の部分インデックス
+            models.Index(
+                fields=['slug'], name='gallery_public_slug_idx',
+                condition=models.Q(is_public=True, deleted_at__isnull=True),
+            ),
         ]
         constraints = [
+            *BaseModel.Meta.constraints,
             # user_style='user' -> owner NOT NULL & guest_id IS NULL/blank
             models.CheckConstraint(
                 name='gallery_user_style_user_requires_owner',
@@ -127,7 +126,9 @@ class Exhibit(BaseModel):
 
     guest_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 
-    slot_index = models.PositiveIntegerField()  # 0..11
+    # 0..11（3x4=12枠）。範囲は validators（DRF の max_value）と CHECK 制約で担保
+    SLOT_INDEX_MAX = 11
+    slot_index = models.PositiveSmallIntegerField(validators=[MaxValueValidator(SLOT_INDEX_MAX)])
 
     # 画像URL（S3 URL）
     image_original_url = models.URLField(max_length=2048)
@@ -141,16 +142,22 @@ class Exhibit(BaseModel):
     title = models.CharField(max_length=255, blank=True, default='')
     description = models.TextField(blank=True, default='')
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'exhibits'
-        unique_together = ('gallery', 'slot_index')
         indexes = [
-            models.Index(fields=['gallery', 'slot_index']),
             models.Index(fields=['user_style', 'created_at']),
             models.Index(fields=['owner', 'created_at']),
             models.Index(fields=['guest_id', 'created_at']),
+            # material_params の包含検索（material_params__contains={'preset': ...}）用
+            GinIndex(fields=['material_params'], name='exhibit_material_gin', opclasses=['jsonb_path_ops']),
         ]
         constraints = [
+            *BaseModel.Meta.constraints,
+            # 論理削除済みを除いて 1枠1件（部分ユニークインデックスとしてホットパスの検索にも使う）
+            models.UniqueConstraint(
+                fields=['gallery', 'slot_index'], name='exhibit_live_slot_uniq',
+                condition=models.Q(deleted_at__isnull=True),
+            ),
             models.CheckConstraint(
                 name='exhibit_slot_index_0_11',
                 check=models.Q(slot_index__gte=0) & models.Q(slot_index__lte=11),
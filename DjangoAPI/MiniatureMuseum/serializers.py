@@ -13,6 +13,10 @@ from django.conf import settings
 
 class ExhibitSerializer(serializers.ModelSerializer):
     """展示物（編集/管理用）。画像はS3 URL（string）を想定。"""
+    # 所有者判定に必要な列だけ取得
+    gallery = serializers.PrimaryKeyRelatedField(
+        queryset=Gallery.objects.only('id', 'owner', 'guest_id'),
+    )
 
     class Meta:
         model = Exhibit
@@ -33,12 +37,6 @@ class ExhibitSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('id', 'owner', 'guest_id', 'created_at', 'updated_at')
 
-    def validate_slot_index(self, value: int) -> int:
-        # 仕様: 0〜11（3x4=12枠）
-        if value < 0 or value > 11:
-            raise serializers.ValidationError("slot_index must be between 0 and 11.")
-        return value
-
     def validate_gallery(self, gallery):
         """自分のGalleryにしか展示できない（owner or guest の二重チェック）。"""
         request = self.context.get('request')
@@ -52,7 +50,7 @@ class ExhibitSerializer(serializers.ModelSerializer):
             return gallery
 
         # guest
-        guest_id = request.headers.get('X-Guest-Id')
+        guest_id = getattr(request, 'guest_id', None)  # GuestAuthentication が設定
         if not guest_id:
             raise serializers.ValidationError("X-Guest-Id header is required.")
         if getattr(gallery, 'guest_id', None) != guest_id:
@@ -60,6 +58,11 @@ class ExhibitSerializer(serializers.ModelSerializer):
         return gallery
 
 
+class NestedExhibitSerializer(ExhibitSerializer):
+    """ネスト型API用。gallery は URL から確定済みなので入力を受け取らない（再取得しない）。"""
+    gallery = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
 class GallerySerializer(serializers.ModelSerializer):
     """ギャラリー（編集/管理用）。retrieveではexhibitsも返す。"""
     exhibits = ExhibitSerializer(many=True, read_only=True)
@@ -1,3 +1,103 @@
+from django.db import IntegrityError, transaction
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from core.models import User
+from . import views
+from .models import Gallery, Exhibit
+
+
+class GalleryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('a@example.com', 'password123')
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.user)
+        self.gallery = Gallery.objects.create(owner=self.user, slug='g1', is_public=True)
+
+    def _exhibit(self, slot_index, **kwargs):
+        return Exhibit.objects.create(
+            gallery=self.gallery, owner=self.user, slot_index=slot_index,
+            image_original_url='https://example.com/a.png', **kwargs,
+        )
+
+
+class ExhibitCreateTests(GalleryTestCase):
+    def test_occupied_slot_is_409(self):
+        self._exhibit(0)
+
+        res = self.client.post(
+            f'/api/galleries/{self.gallery.id}/exhibits/',
+            {'slotIndex': 0, 'imageOriginalUrl': 'https://example.com/b.png'}, format='json',
+        )
+
+        self.assertEqual(res.status_code, 409)
+
+    def test_out_of_range_slot_is_400(self):
+        # 範囲はモデルの validators（PositiveSmallIntegerField + MaxValueValidator）から来る
+        for slot_index in (-1, Exhibit.SLOT_INDEX_MAX + 1):
+            res = self.client.post(
+                f'/api/galleries/{self.gallery.id}/exhibits/',
+                {'slotIndex': slot_index, 'imageOriginalUrl': 'https://example.com/b.png'}, format='json',
+            )
+            self.assertEqual(res.status_code, 400)
+            self.assertIn('slotIndex', res.json())
+
+    def test_only_the_live_slot_constraint_is_a_conflict(self):
+        self._exhibit(0)
+        with self.assertRaises(IntegrityError) as dup, transaction.atomic():
+            self._exhibit(0)
+        # CHECK 違反（slot_index の範囲）は競合ではない
+        with self.assertRaises(IntegrityError) as check, transaction.atomic():
+            self._exhibit(12)
+
+        self.assertTrue(views._is_slot_conflict(dup.exception))
+        self.assertFalse(views._is_slot_conflict(check.exception))
+
+
+class ExhibitSlotPutTests(GalleryTestCase):
+    def _put(self, slot_index, title):
+        return self.client.put(
+            f'/api/galleries/{self.gallery.id}/exhibits/{slot_index}/',
+            {'slotIndex': slot_index, 'imageOriginalUrl': 'https://example.com/b.png', 'title': title}, format='json',
+        )
+
+    def test_creates_then_replaces(self):
+        created = self._put(3, 'first')
+        replaced = self._put(3, 'second')
+
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(replaced.status_code, 200)
+        self.assertEqual(replaced.json()['id'], created.json()['id'])
+        live = Exhibit.objects.filter(gallery=self.gallery, slot_index=3, deleted_at__isnull=True)
+        self.assertEqual(list(live.values_list('title', flat=True)), ['second'])
+
+    def test_out_of_range_url_slot_is_400(self):
+        self.assertEqual(self._put(Exhibit.SLOT_INDEX_MAX + 1, 'x').status_code, 400)
+
+
+class GalleryPublicTests(GalleryTestCase):
+    url = '/api/galleries/g/g1/'
+
+    def test_matching_if_none_match_is_304_with_validators(self):
+        self._exhibit(0)
+        first = self.client.get(self.url)
+
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res['ETag'], first['ETag'])
+        self.assertEqual(res['Cache-Control'], first['Cache-Control'])
+        self.assertIn('max-age=%d' % views.PUBLIC_GALLERY_MAX_AGE, res['Cache-Control'])
+
+    def test_etag_changes_after_exhibit_edit(self):
+        exhibit = self._exhibit(0, title='before')
+        etag = self.client.get(self.url)['ETag']
+
+        exhibit.title = 'after'
+        exhibit.save()
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res.json()['exhibits'][0]['title'], 'after')
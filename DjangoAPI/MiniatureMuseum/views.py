@@ -1,24 +1,48 @@
 from django.shortcuts import render
 
 # Create your views here.
-from rest_framework import viewsets, views, status, generics
+from rest_framework import viewsets, views, status, generics, serializers
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.exceptions import NotAuthenticated, PermissionDenied
 from rest_framework.decorators import action
+from rest_framework.settings import api_settings
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, Max
+from .authentication import GuestAuthentication
 from .models import Gallery, Exhibit
 from .serializers import (
-    GallerySerializer, ExhibitSerializer, ExhibitPublicSerializer,GalleryPublicSerializer
+    GallerySerializer, ExhibitSerializer, NestedExhibitSerializer, ExhibitPublicSerializer,GalleryPublicSerializer
 )
 
 from drf_spectacular.utils import extend_schema, OpenApiResponse
+from config.renderers import ORJSONRenderer
 
+import hashlib
 
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.decorators import method_decorator
+from django.views.decorators.vary import vary_on_headers
 
+# 公開ビューアの HTTP キャッシュ / サーバ側キャッシュ（秒）
+PUBLIC_GALLERY_MAX_AGE = 60
+PUBLIC_GALLERY_CACHE_TIMEOUT = 60 * 10
+
+# gallery.user_style -> Exhibit 保存時の所有者フィールド
+_USER_KW = {
+    'user': lambda ident: {'user_style': 'user', 'owner': ident, 'guest_id': None},
+    'guest': lambda ident: {'user_style': 'guest', 'owner': None, 'guest_id': ident},
+}
+
+
+def _is_slot_conflict(exc):
+    """IntegrityError が同じ枠の生存中 Exhibit との重複（exhibit_live_slot_uniq）かどうか"""
+    diag = getattr(exc.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None) == 'exhibit_live_slot_uniq'
 
-# --- Gallery Public Viewer (public read by slug) ---
 
 # --- Nested Exhibit API (recommended) ---
 # POST /api/galleries/{gallery_id}/exhibits/
@@ -27,19 +51,23 @@ from drf_spectacular.utils import extend_schema, OpenApiResponse
 
 class _GalleryActorMixin:
     """Galleryの所有者判定（user/guest）を共通化"""
+    # JWT を先頭に残す（401 の WWW-Authenticate は先頭の認証クラスから決まる）
+    authentication_classes = [*api_settings.DEFAULT_AUTHENTICATION_CLASSES, GuestAuthentication]
 
     def _actor(self, request):
         # returns ('user', user_obj) | ('guest', guest_id) | (None, None)
         if request.user and request.user.is_authenticated:
             return ('user', request.user)
-        guest_id = request.headers.get('X-Guest-Id')
+        guest_id = getattr(request, 'guest_id', None)
         if guest_id:
             return ('guest', guest_id)
         return (None, None)
 
     def _get_owned_gallery_or_404(self, request, gallery_id):
+        # 所有者判定に必要な列だけ取得
+        qs = Gallery.objects.only('id', 'user_style', 'owner', 'guest_id', 'deleted_at')
         try:
-            gallery = Gallery.objects.filter(id=gallery_id, deleted_at__isnull=True).get()
+            gallery = qs.get(id=gallery_id, deleted_at__isnull=True)
         except Gallery.DoesNotExist:
             raise PermissionDenied('Gallery not found.')
 
@@ -62,9 +90,9 @@ class _GalleryActorMixin:
 
 
 @extend_schema(
-request=ExhibitSerializer,
+request=NestedExhibitSerializer,
 responses={
-    201: ExhibitSerializer,
+    201: NestedExhibitSerializer,
     400: OpenApiResponse(description="Bad Request"),
     401: OpenApiResponse(description="Not Authenticated"),
     403: OpenApiResponse(description="Forbidden"),
@@ -79,25 +107,26 @@ class GalleryExhibitCreateView(_GalleryActorMixin, views.APIView):
     def post(self, request, gallery_id, *args, **kwargs):
         gallery, (mode, ident) = self._get_owned_gallery_or_404(request, gallery_id)
 
-        serializer = ExhibitSerializer(data=request.data, context={'request': request})
+        serializer = NestedExhibitSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
 
         slot_index = serializer.validated_data.get('slot_index')
         if slot_index is None:
             return Response({'detail': 'slot_index is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        save_kwargs = {'gallery': gallery, **_USER_KW[gallery.user_style](ident)}
+
         # 既に埋まってたら 409（POSTは追加専用）
-        if Exhibit.objects.filter(gallery=gallery, slot_index=slot_index, deleted_at__isnull=True).exists():
+        # 事前の exists() はせず、unique 制約違反で判定する（往復削減 + 競合に強い）
+        try:
+            with transaction.atomic():
+                serializer.save(**save_kwargs)
+        except IntegrityError as e:
+            # CHECK / FK 違反などは競合ではないのでそのまま上げる
+            if not _is_slot_conflict(e):
+                raise
             return Response({'detail': 'Slot already occupied.'}, status=status.HTTP_409_CONFLICT)
-
-        save_kwargs = {'gallery': gallery}
-        if gallery.user_style == 'user':
-            save_kwargs.update({'user_style': 'user', 'owner': ident, 'guest_id': None})
-        else:
-            save_kwargs.update({'user_style': 'guest', 'guest_id': ident, 'owner': None})
-
-        exhibit = serializer.save(**save_kwargs)
-        return Response(ExhibitSerializer(exhibit, context={'request': request}).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class GalleryExhibitSlotUpsertView(_GalleryActorMixin, views.APIView):
@@ -105,40 +134,49 @@ class GalleryExhibitSlotUpsertView(_GalleryActorMixin, views.APIView):
     permission_classes = [AllowAny]
 
     @extend_schema(
-        request=ExhibitSerializer,
+        request=NestedExhibitSerializer,
         responses={
-            200: ExhibitSerializer,
-            201: ExhibitSerializer,
+            200: NestedExhibitSerializer,
+            201: NestedExhibitSerializer,
             400: OpenApiResponse(description="Bad Request"),
             401: OpenApiResponse(description="Not Authenticated"),
             403: OpenApiResponse(description="Forbidden"),
+            409: OpenApiResponse(description="Slot is being updated"),
         },
     )
     def put(self, request, gallery_id, slot_index: int, *args, **kwargs):
+        # URL の slot_index は <int:> で上限が無いので、DB に投げる前に範囲を確かめる
+        if slot_index > Exhibit.SLOT_INDEX_MAX:
+            return Response({'detail': 'Invalid slot_index.'}, status=status.HTTP_400_BAD_REQUEST)
         gallery, (mode, ident) = self._get_owned_gallery_or_404(request, gallery_id)
+        save_kwargs = {'gallery': gallery, 'slot_index': slot_index, **_USER_KW[gallery.user_style](ident)}
 
         try:
-            exhibit = Exhibit.objects.filter(gallery=gallery, slot_index=slot_index, deleted_at__isnull=True).get()
-            partial = False  # 置換に寄せる
-            serializer = ExhibitSerializer(exhibit, data=request.data, partial=partial, context={'request': request})
-            serializer.is_valid(raise_exception=True)
-        except Exhibit.DoesNotExist:
-            serializer = ExhibitSerializer(data=request.data, context={'request': request})
-            serializer.is_valid(raise_exception=True)
-            exhibit = None
-
-        save_kwargs = {'gallery': gallery, 'slot_index': slot_index}
-        if gallery.user_style == 'user':
-            save_kwargs.update({'user_style': 'user', 'owner': ident, 'guest_id': None})
-        else:
-            save_kwargs.update({'user_style': 'guest', 'guest_id': ident, 'owner': None})
-
-        if exhibit is None:
-            obj = serializer.save(**save_kwargs)
-            return Response(ExhibitSerializer(obj, context={'request': request}).data, status=status.HTTP_201_CREATED)
-
-        obj = serializer.save(**save_kwargs)
-        return Response(ExhibitSerializer(obj, context={'request': request}).data, status=status.HTTP_200_OK)
+            with transaction.atomic():
+                # 先に対象枠の行をロックしてから読む（SELECT ... FOR UPDATE SKIP LOCKED の1本）
+                # 無ければ作成。同じ枠を置換中でロックが取れなかった場合も None になるが、
+                # そのときの INSERT は unique 制約違反になり下で 409 にする
+                exhibit = (
+                    Exhibit.objects
+                    .select_for_update(skip_locked=True)
+                    .filter(gallery=gallery, slot_index=slot_index, deleted_at__isnull=True)
+                    .first()
+                )
+                # 既存があれば置換（partial=False）、無ければ作成。serializer は1つで両方扱う
+                serializer = NestedExhibitSerializer(exhibit, data=request.data, context={'request': request})
+                serializer.is_valid(raise_exception=True)
+                serializer.save(**save_kwargs)
+        except IntegrityError as e:
+            # 同じ枠への同時作成・置換中の枠への作成（unique 制約違反）だけ 409
+            if not _is_slot_conflict(e):
+                raise
+            return Response({'detail': 'Slot is being updated.'}, status=status.HTTP_409_CONFLICT)
+
+        # 保存済み serializer の data を再利用（2回目のシリアライズをしない）
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if exhibit is None else status.HTTP_200_OK,
+        )
 
     @extend_schema(
         request=None,
@@ -152,29 +190,11 @@ class GalleryExhibitSlotUpsertView(_GalleryActorMixin, views.APIView):
     def delete(self, request, gallery_id, slot_index: int, *args, **kwargs):
         gallery, (mode, ident) = self._get_owned_gallery_or_404(request, gallery_id)
         qs = Exhibit.objects.filter(gallery=gallery, slot_index=slot_index, deleted_at__isnull=True)
-        deleted = qs.delete()[0]
+        deleted = qs.soft_delete()
         if deleted == 0:
             return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class GalleryPublicViewer(views.APIView):
-    """公開閲覧用: slug から Gallery + 全Exhibit を取得して返す（is_publicのみ）"""
-    permission_classes = [AllowAny]
-
-    def get(self, request, slug: str, *args, **kwargs):
-        try:
-            gallery = (
-                Gallery.objects
-                .filter(slug=slug, is_public=True, deleted_at__isnull=True)
-                .prefetch_related(models.Prefetch('exhibits', queryset=Exhibit.objects.order_by('slot_index')))
-                .get()
-            )
-        except Gallery.DoesNotExist:
-            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
-
-        serializer = GalleryPublicSerializer(gallery, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
-
 # --- 6. Gallery / Exhibit API ---
 
 class GalleryViewSet(viewsets.ModelViewSet):
@@ -183,7 +203,19 @@ class GalleryViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Gallery.objects.filter(owner=self.request.user).order_by('-updated_at')
+        # list/retrieve とも GallerySerializer が exhibits を含むので常に prefetch
+        return (
+            Gallery.objects
+            .filter(owner=self.request.user)
+            .select_related('owner')
+            .prefetch_related(
+                models.Prefetch(
+                    'exhibits',
+                    queryset=Exhibit.objects.filter(deleted_at__isnull=True).order_by('slot_index'),
+                )
+            )
+            .order_by('-updated_at')
+        )
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -196,24 +228,105 @@ class ExhibitViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # 自分の Exhibit のみ（Gallery owner と Exhibit owner の二重チェック）
-        return Exhibit.objects.filter(owner=self.request.user).select_related('gallery').order_by('-updated_at')
+        return (
+            Exhibit.objects
+            .filter(owner=self.request.user)
+            .select_related('gallery', 'owner', 'gallery__owner')
+            .order_by('-updated_at')
+        )
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
 
 
+_GALLERY_PUBLIC_FIELDS = tuple(f for f in GalleryPublicSerializer.Meta.fields if f != 'exhibits')
+_EXHIBIT_PUBLIC_FIELDS = ExhibitPublicSerializer.Meta.fields
+_datetime_field = serializers.DateTimeField()
+
+
+def _public_row(row):
+    """values() の1行を DRF と同じ表現（UUID は文字列、日時は TIME_ZONE の ISO 8601）にする"""
+    row['id'] = str(row['id'])
+    row['created_at'] = _datetime_field.to_representation(row['created_at'])
+    row['updated_at'] = _datetime_field.to_representation(row['updated_at'])
+    return row
+
+
+@method_decorator(vary_on_headers('Accept-Encoding'), name='dispatch')
 class GalleryPublicView(generics.RetrieveAPIView):
     serializer_class = GalleryPublicSerializer
     permission_classes = [AllowAny]
+    renderer_classes = [ORJSONRenderer]
+    _renderer = ORJSONRenderer()
     lookup_field = 'slug'
     lookup_url_kwarg = 'slug'  # ←これを追加（安全）
 
+    def _etag(self, slug):
+        # gallery.updated_at + 展示物の最終更新/件数（物理削除も件数で検知）だけを軽量に取得
+        stamp = (
+            Gallery.objects
+            .filter(slug=slug, is_public=True, deleted_at__isnull=True)
+            .annotate(exhibits_updated_at=Max('exhibits__updated_at'), exhibits_count=Count('exhibits'))
+            .values_list('id', 'updated_at', 'exhibits_updated_at', 'exhibits_count')
+            .first()
+        )
+        if stamp is None:
+            raise Http404
+        return quote_etag(hashlib.md5(repr(stamp).encode()).hexdigest())
+
+    def retrieve(self, request, *args, **kwargs):
+        slug = kwargs[self.lookup_url_kwarg]
+        etag = self._etag(slug)
+
+        # If-None-Match が一致すれば 304
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return self._with_validators(not_modified, etag)
+
+        # ETag をキーに含めるので、更新時の明示的な invalidate は不要
+        # レンダリング済み bytes をキャッシュし、ヒット時は camelize / エンコードも省く
+        cache_key = f'gallery_public:{slug}:{etag}'
+        body = cache.get(cache_key)
+        if body is None:
+            body = self._renderer.render(self._build_payload(slug))
+            cache.set(cache_key, body, timeout=PUBLIC_GALLERY_CACHE_TIMEOUT)
+
+        return self._with_validators(HttpResponse(body, content_type=self._renderer.media_type), etag)
+
+    @staticmethod
+    def _with_validators(response, etag):
+        # 200 と 304 に同じ ETag / Cache-Control を付ける（304 も検証子を返す: RFC 9110 15.4.5）
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=PUBLIC_GALLERY_MAX_AGE)
+        return response
+
+    def _build_payload(self, slug):
+        # 読み取り専用の固定スキーマなので ModelSerializer は通さず values() から直接組み立てる
+        # （出力形式は GalleryPublicSerializer と同じ。スキーマ生成は serializer_class を使う）
+        gallery = (
+            Gallery.objects
+            .filter(slug=slug, is_public=True, deleted_at__isnull=True)
+            .values(*_GALLERY_PUBLIC_FIELDS)
+            .first()
+        )
+        if gallery is None:
+            raise Http404
+        exhibits = (
+            Exhibit.objects
+            .filter(gallery_id=gallery['id'], deleted_at__isnull=True)
+            .order_by('slot_index')
+            .values(*_EXHIBIT_PUBLIC_FIELDS)
+        )
+        data = _public_row(gallery)
+        data['exhibits'] = [_public_row(e) for e in exhibits]
+        return data
+
     def get_queryset(self):
         return (
             Gallery.objects
             .filter(is_public=True, deleted_at__isnull=True)  # ←論理削除あるなら入れる
             .prefetch_related(
-                models.Prefetch('exhibits', queryset=Exhibit.objects.order_by('slot_index'))
+                models.Prefetch('exhibits', queryset=Exhibit.objects.filter(deleted_at__isnull=True).order_by('slot_index'))
             )
         )
@@ -0,0 +1,31 @@
+import orjson
+from djangorestframework_camel_case.settings import api_settings as camel_settings
+from djangorestframework_camel_case.util import camelize
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    orjson で bytes を直接出力する JSONRenderer。
+    CamelCaseJSONRenderer と同じくキーを camelCase に変換する。
+    """
+    json_underscoreize = camel_settings.JSON_UNDERSCOREIZE
+
+    # orjson が扱えない型（lazy 文字列 / Decimal など）は DRF と同じ変換に回す
+    _default = staticmethod(JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        # ListField / DictField のエラーは int キーの dict になる
+        option = orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+
+        return orjson.dumps(
+            camelize(data, **self.json_underscoreize),
+            default=self._default,
+            option=option,
+        )
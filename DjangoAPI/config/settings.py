@@ -14,6 +14,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 import environ
+from django.core.exceptions import ImproperlyConfigured
 from datetime import timedelta
 
 
@@ -200,7 +201,8 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_RENDERER_CLASSES': (
-        'djangorestframework_camel_case.render.CamelCaseJSONRenderer',
+        # CamelCaseJSONRenderer と同じ camelCase 出力を orjson で書き出す
+        'config.renderers.ORJSONRenderer',
         'djangorestframework_camel_case.render.CamelCaseBrowsableAPIRenderer',
         'rest_framework.renderers.JSONRenderer',
     ),
@@ -231,10 +233,21 @@ SPECTACULAR_SETTINGS = {
         'drf_spectacular.contrib.djangorestframework_camel_case.camelize_serializer_fields',
         'drf_spectacular.hooks.postprocess_schema_enums',
     ],
+    # 読み取り用 Serializer を分けても enum のコンポーネント名が変わらないよう固定
+    'ENUM_NAME_OVERRIDES': {
+        'PageTypeEnum': 'core.models.Page.TYPE_CHOICES',
+        'ScheduleTypeEnum': 'core.models.Schedule.TYPE_CHOICES',
+    },
 }
 
 
 
+# キャッシュ（公開ギャラリー等）。本番は CACHE_URL=redis://... を指定
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+
 # --- 4. AWS S3 Settings (Boto3用) ---
 AWS_ACCESS_KEY_ID = env('AWS_ACCESS_KEY_ID',default="dummy")
 AWS_SECRET_ACCESS_KEY = env('AWS_SECRET_ACCESS_KEY', default="dummy")
@@ -248,6 +261,13 @@ raw_key = env("CLOUDFRONT_PRIVATE_KEY", default=None)
 # キーが存在する場合のみ改行コードの置換処理を行う
 CLOUDFRONT_PRIVATE_KEY = raw_key.replace('\\n', '\n') if raw_key else None
 CLOUDFRONT_URL_EXPIRES_SECONDS = int(env("CLOUDFRONT_URL_EXPIRES_SECONDS", default=3600))  # 署名付きURLの有効期限（秒）
+# 署名のハッシュ: SHA1（既定・CloudFront の従来方式） / SHA256（Hash-Algorithm=SHA256 を付けて署名する）
+CLOUDFRONT_SIGNATURE_HASH = env("CLOUDFRONT_SIGNATURE_HASH", default="SHA1").upper()
+# 綴り間違いは最初の署名（ユーザーのリクエスト）で 500 になる前に、起動時に落とす
+if CLOUDFRONT_SIGNATURE_HASH not in ("SHA1", "SHA256"):
+    raise ImproperlyConfigured(
+        f"CLOUDFRONT_SIGNATURE_HASH must be SHA1 or SHA256, got {CLOUDFRONT_SIGNATURE_HASH!r}"
+    )
 
 # S3のオブジェクトパラメータ設定
 AWS_S3_OBJECT_PARAMETERS = {
@@ -1,6 +1,7 @@
-import json
+import orjson
 from django import forms
 from django.contrib import admin
+from django.db import models
 from django.utils.safestring import mark_safe
 from django.core.files.storage import default_storage
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
@@ -45,10 +46,12 @@ class StickerAdminForm(forms.ModelForm):
         instance = super().save(commit=False)
         uploaded_file = self.cleaned_data.get('upload_file')
         if uploaded_file:
+            # 検証時に開いた Pillow の画像からサイズを1回だけ読む
+            w, h = uploaded_file.image.size
             path = default_storage.save(f"stickers/{instance.id}.png", uploaded_file)
-            instance.png = {"kind": "remote", "key": path, "mime": "image/png", "width": uploaded_file.image.width, "height": uploaded_file.image.height}
-            instance.width = uploaded_file.image.width
-            instance.height = uploaded_file.image.height
+            instance.png = {"kind": "remote", "key": path, "mime": "image/png", "width": w, "height": h}
+            instance.width = w
+            instance.height = h
         if commit:
             instance.save()
         return instance
@@ -57,16 +60,35 @@ class StickerAdminForm(forms.ModelForm):
 class StickerAdmin(admin.ModelAdmin):
     form = StickerAdminForm
     list_display = ('name', 'owner', 'width', 'height')
+    # 一覧の owner 列で行ごとに User を引かない
+    list_select_related = ('owner',)
     # 自動計算されるフィールドは読み取り専用にする
     readonly_fields = ('width', 'height', 'png') 
 
+# ---------------------------------------------------------
+# JSON 入力欄（scene_data / events_data は大きいので orjson で整形して表示する）
+# ---------------------------------------------------------
+class ORJSONFormField(forms.JSONField):
+    def prepare_value(self, value):
+        if isinstance(value, forms.fields.InvalidJSONInput):
+            return value
+        try:
+            return orjson.dumps(value, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # orjson が扱えない型は標準の JSONField に任せる
+            return super().prepare_value(value)
+
+JSON_FORMFIELD_OVERRIDES = {models.JSONField: {'form_class': ORJSONFormField}}
+
 # ---------------------------------------------------------
 # Page Admin (修正)
 # ---------------------------------------------------------
 @admin.register(Page)
 class PageAdmin(admin.ModelAdmin):
     list_display = ('title', 'owner', 'type', 'date', 'id')
+    list_select_related = ('owner',)
     list_filter = ('type', 'date')
+    formfield_overrides = JSON_FORMFIELD_OVERRIDES
     
     # フォームのフィールド指定（自動入力フィールドを除外）
     fields = ('owner', 'type', 'date', 'title', 'note', 'tags', 'scene_data', 'assets')
@@ -89,6 +111,7 @@ class NotebookPageInline(admin.TabularInline):
 @admin.register(Notebook)
 class NotebookAdmin(admin.ModelAdmin):
     list_display = ('title', 'owner')
+    list_select_related = ('owner',)
     inlines = [NotebookPageInline]
     # 中間テーブルの管理をしやすくする
     filter_horizontal = ('pages',) # ManyToManyFieldを直接操作する場合
@@ -99,16 +122,20 @@ class NotebookAdmin(admin.ModelAdmin):
 @admin.register(Schedule)
 class ScheduleAdmin(admin.ModelAdmin):
     list_display = ('title', 'owner', 'type', 'start_date')
+    list_select_related = ('owner',)
     fields = ('owner', 'type', 'start_date', 'title', 'scene_data', 'events_data')
+    formfield_overrides = JSON_FORMFIELD_OVERRIDES
 
 # Other Models
 @admin.register(UploadSession)
 class UploadSessionAdmin(admin.ModelAdmin):
     list_display = ('user', 'purpose', 'status')
+    list_select_related = ('user',)
 
 @admin.register(NotebookPage)
 class NotebookPageAdmin(admin.ModelAdmin):
     list_display = ('notebook', 'page', 'position')
+    list_select_related = ('notebook', 'page')
     raw_id_fields = ('notebook', 'page') # 必須: ドロップダウンが重すぎるのを防ぐ
 
 admin.site.register(FriendRequest)
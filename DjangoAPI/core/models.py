@@ -1,32 +1,82 @@
 
 # Create your models here.
+import os
+import time
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.contrib.postgres.indexes import GinIndex
 from django.utils import timezone
 
+
+def uuid7():
+    """
+    UUIDv7（RFC 9562）を生成する
+    先頭 48bit が Unix ミリ秒なので、主キーの B-Tree には末尾側へ順に挿入される
+    """
+    ts_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), 'big')  # 80bit = rand_a(12) + 余り(6) + rand_b(62)
+    value = (
+        (ts_ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76                        # version
+        | (rand >> 68) << 64               # rand_a
+        | 0b10 << 62                       # variant
+        | (rand & 0x3FFF_FFFF_FFFF_FFFF)   # rand_b
+    )
+    return uuid.UUID(int=value)
+
+
 # -----------------------------------------------------------------------------
 # 0. 共通 Abstract Model
 # -----------------------------------------------------------------------------
 
+class SoftDeleteQuerySet(models.QuerySet):
+    def soft_delete(self):
+        """論理削除をまとめて1回の UPDATE で行う"""
+        now = timezone.now()
+        return self.update(deleted_at=now, updated_at=now)
+
+    soft_delete.alters_data = True
+    soft_delete.queryset_only = True
+
+
+class AliveManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """論理削除されていない行だけを返す Manager（部分インデックスと条件を揃える）"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class BaseModel(models.Model):
     """
     全モデル共通の基底クラス
     UUIDプライマリキーと監査ログ用フィールドを持つ
     """
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    schema_version = models.PositiveIntegerField(default=1)  # マイグレーション用
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
+    schema_version = models.PositiveSmallIntegerField(default=1)  # マイグレーション用
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True, blank=True)  # 論理削除用
 
+    objects = models.Manager.from_queryset(SoftDeleteQuerySet)()
+    alive = AliveManager()
+
     class Meta:
         abstract = True
+        # 子モデルは class Meta(BaseModel.Meta) で継承し、独自の constraints は連結する
+        constraints = [
+            models.CheckConstraint(
+                name='%(app_label)s_%(class)s_schema_version_range',
+                check=models.Q(schema_version__gte=1, schema_version__lte=32767),
+            ),
+        ]
 
     def delete(self, using=None, keep_parents=False):
-        """論理削除の実装"""
-        self.deleted_at = timezone.now()
-        self.save()
+        """論理削除の実装（対象列だけの UPDATE 1回）"""
+        now = timezone.now()
+        type(self)._base_manager.using(using or self._state.db).filter(pk=self.pk).update(deleted_at=now, updated_at=now)
+        self.deleted_at = now
+        self.updated_at = now
 
 # -----------------------------------------------------------------------------
 # 1. User & Upload Session
@@ -69,7 +119,7 @@ class User(AbstractUser, BaseModel):
 
     objects = UserManager()
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'users'
 
 
@@ -93,7 +143,7 @@ class UploadSession(BaseModel):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='issued')
     expires_at = models.DateTimeField()
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'upload_sessions'
 
 # -----------------------------------------------------------------------------
@@ -109,7 +159,7 @@ class FriendRequest(BaseModel):
         default='pending'
     )
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'friend_requests'
         unique_together = ('requester', 'target')
 
@@ -117,7 +167,7 @@ class Friendship(BaseModel):
     user1 = models.ForeignKey(User, related_name='friendships1', on_delete=models.CASCADE)
     user2 = models.ForeignKey(User, related_name='friendships2', on_delete=models.CASCADE)
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'friendships'
         unique_together = ('user1', 'user2')
         indexes = [
@@ -150,11 +200,16 @@ class Sticker(BaseModel):
     # CropSource JSON
     crop_source = models.JSONField(null=True, blank=True)
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'stickers'
         indexes = [
             models.Index(fields=['owner', 'favorite']),
-            models.Index(fields=['owner', 'last_used_at']),
+            # 論理削除されていない行だけの部分インデックス（owner で絞って新しい順に読む）
+            models.Index(fields=['owner', '-last_used_at'], name='sticker_owner_lastused', condition=models.Q(deleted_at__isnull=True)),
+            # StickerViewSet の一覧（owner, -created_at）
+            models.Index(fields=['owner', '-created_at'], name='sticker_owner_created', condition=models.Q(deleted_at__isnull=True)),
+            # ?tag= の tags @> '["foo"]' 用
+            GinIndex(fields=['tags'], name='stickers_tags_gin', opclasses=['jsonb_path_ops']),
         ]
 
 # -----------------------------------------------------------------------------
@@ -188,11 +243,15 @@ class Page(BaseModel):
     layout_mode = models.CharField(max_length=20, default='auto') # portrait/landscape/auto
     layout_settings = models.JSONField(default=dict)
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'pages'
         indexes = [
-            models.Index(fields=['owner', 'date']),
+            # PageViewSet の一覧（alive, owner, -date）
+            models.Index(fields=['owner', '-date'], name='page_owner_date_alive', condition=models.Q(deleted_at__isnull=True)),
             models.Index(fields=['owner', 'type']),
+            # 論理削除されていないページだけの部分インデックス（notebook_pages との JOIN 用）
+            models.Index(fields=['id'], name='page_alive_idx', condition=models.Q(deleted_at__isnull=True)),
+            GinIndex(fields=['tags'], name='pages_tags_gin', opclasses=['jsonb_path_ops']),
         ]
 
 class Schedule(BaseModel):
@@ -223,7 +282,7 @@ class Schedule(BaseModel):
     # プレビュー画像
     preview = models.JSONField(null=True, blank=True)
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'schedules'
         # 同じ期間・同じタイプのスケジュールは1人1つまでとする制約（任意）
         unique_together = ('owner', 'type', 'start_date')
@@ -257,12 +316,35 @@ class Notebook(BaseModel):
     # ManyToMany with explicit through model for ordering
     pages = models.ManyToManyField(Page, through='NotebookPage', related_name='notebooks')
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         db_table = 'notebooks'
+        indexes = [
+            GinIndex(fields=['tags'], name='notebooks_tags_gin', opclasses=['jsonb_path_ops']),
+        ]
+
+    def reorder_pages(self, page_ids):
+        """
+        page_ids の順に position を 0, 1, 2... と振り直す
+        リストに無いページはその後ろに今の順序のまま並べる（position が重ならないように）
+        行ごとの save() ではなく bulk_update（500 行ごとに UPDATE ... CASE 1本）
+        """
+        order = {page_id: i for i, page_id in enumerate(page_ids)}
+        with transaction.atomic():
+            rows = list(
+                self.notebookpage_set
+                .select_for_update()
+                .order_by('position', 'added_at')
+                .only('id', 'page_id', 'position')
+            )
+            rows.sort(key=lambda row: order.get(row.page_id, len(order)))
+            for i, row in enumerate(rows):
+                row.position = i
+            NotebookPage.objects.bulk_update(rows, ['position'], batch_size=500)
+        return len(rows)
 
 class NotebookPage(models.Model):
     """中間テーブル：ページ順序を管理"""
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     notebook = models.ForeignKey(Notebook, on_delete=models.CASCADE)
     page = models.ForeignKey(Page, on_delete=models.CASCADE)
     position = models.IntegerField(default=0) # 並び順
@@ -273,7 +355,8 @@ class NotebookPage(models.Model):
         ordering = ['position']
         unique_together = ('notebook', 'page')
         indexes = [
-            models.Index(fields=['notebook', 'position']),
+            # page_ids 取得（notebook 指定で position 順）を index-only scan にするため page を INCLUDE
+            models.Index(fields=['notebook', 'position'], name='nbpage_np_pos_idx', include=['page']),
         ]
 
 # -----------------------------------------------------------------------------
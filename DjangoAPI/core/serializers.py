@@ -2,7 +2,6 @@ from rest_framework import serializers
 from .models import Schedule, User, UploadSession, Sticker, Page, Notebook, NotebookPage
 from django.core.files.storage import default_storage
 from storages.backends.s3boto3 import S3Boto3Storage
-from .utils_for_cloudfront import generate_cf_signed_url
 from drf_spectacular.utils import extend_schema_field  # これをインポート
 from drf_spectacular.types import OpenApiTypes
 
@@ -40,11 +39,26 @@ class ExcalidrawSceneDataSerializer(serializers.Serializer):
     )
     
 
+# --- 読み取り専用の JSON 素通しフィールド ---
+# 一覧/詳細の出力では入れ子の Serializer を辿らず、保存済み JSON をそのまま返す
+# （スキーマ上の型は書き込み用 Serializer と同じものを付ける）
+@extend_schema_field(ExcalidrawSceneDataSerializer)
+class SceneDataJSONField(serializers.JSONField):
+    pass
+
+@extend_schema_field(AssetRefSerializer)
+class AssetRefJSONField(serializers.JSONField):
+    pass
+
+@extend_schema_field(serializers.DictField(child=AssetRefSerializer()))
+class AssetRefMapJSONField(serializers.JSONField):
+    pass
+
+
 # --- User ---
 class UserSerializer(serializers.ModelSerializer):
-    @extend_schema_field(AssetRefSerializer) # JSONFieldに型を付与
-    def get_avatar(self, obj):
-        return obj.avatar
+    # モデルの JSONField をそのまま読み書きする（メソッド呼び出しを挟まない。スキーマ上は AssetRef）
+    avatar = AssetRefJSONField(required=False, allow_null=True)
     class Meta:
         model = User
         fields = ('id', 'email', 'display_name', 'avatar', 'stripe_customer_id', 'subscription_status', 'plan')
@@ -83,6 +97,15 @@ class UploadConfirmSerializer(serializers.Serializer):
     """アップロード完了報告（クライアント→サーバー）"""
     upload_session_id = serializers.UUIDField()
 
+class UploadBatchConfirmSerializer(serializers.Serializer):
+    """複数アップロードの完了報告（まとめて S3 を確認する）"""
+    upload_session_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=100)
+
+class UploadBatchConfirmResponseSerializer(serializers.Serializer):
+    """複数アップロードの確認結果（S3 に実体があったもの / 無かったもの）"""
+    confirmed = serializers.ListField(child=serializers.UUIDField())
+    missing = serializers.ListField(child=serializers.UUIDField())
+
 # --- Sticker ---
 class StickerStyleSerializer(serializers.Serializer):
     outline = serializers.DictField()
@@ -100,7 +123,8 @@ class StickerSerializer(serializers.ModelSerializer):
     )
     class Meta:
         model = Sticker
-        fields = '__all__'
+        fields = ('id', 'png', 'thumb', 'style', 'tags', 'schema_version', 'created_at', 'updated_at', 'deleted_at',
+                  'name', 'favorite', 'last_used_at', 'usage_count', 'is_system', 'width', 'height', 'crop_source', 'owner')
         read_only_fields = ('id', 'owner', 'created_at', 'updated_at', 'usage_count')
 
 
@@ -117,9 +141,26 @@ class PageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Page
-        fields = '__all__'
+        fields = ('id', 'assets', 'preview', 'export', 'scene_data', 'used_sticker_ids', 'schema_version',
+                  'created_at', 'updated_at', 'deleted_at', 'type', 'date', 'title', 'note', 'tags',
+                  'layout_mode', 'layout_settings', 'owner')
         read_only_fields = ('id', 'owner', 'created_at', 'updated_at')
 
+class PageReadSerializer(PageSerializer):
+    """list / retrieve 用。scene_data などを再検証・再構築せずに返す"""
+    assets = AssetRefMapJSONField()
+    preview = AssetRefJSONField(required=False, allow_null=True)
+    scene_data = SceneDataJSONField(required=False)
+
+class PageSummarySerializer(serializers.ModelSerializer):
+    """一覧の要約用（GET /api/pages/summary/）。scene_data / assets などの大きい JSON 列を含めない"""
+    preview = AssetRefJSONField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Page
+        fields = ('id', 'owner', 'type', 'date', 'title', 'note', 'tags', 'preview', 'created_at', 'updated_at')
+        read_only_fields = fields
+
 # --- Schedule ---
 class ScheduleSerializer(serializers.ModelSerializer):
     assets = serializers.DictField(child=AssetRefSerializer())
@@ -128,22 +169,43 @@ class ScheduleSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Schedule
-        fields = '__all__'
+        fields = ('id', 'assets', 'preview', 'scene_data', 'schema_version', 'created_at', 'updated_at', 'deleted_at',
+                  'type', 'start_date', 'title', 'events_data', 'owner')
         read_only_fields = ('id', 'owner', 'created_at', 'updated_at')
 
+class ScheduleReadSerializer(ScheduleSerializer):
+    """list / retrieve 用。scene_data などを再検証・再構築せずに返す"""
+    assets = AssetRefMapJSONField()
+    preview = AssetRefJSONField(required=False, allow_null=True)
+    scene_data = SceneDataJSONField(required=False)
+
+class ScheduleSummarySerializer(serializers.ModelSerializer):
+    """一覧の要約用（GET /api/schedules/summary/）。scene_data / assets / events_data を含めない"""
+    preview = AssetRefJSONField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Schedule
+        fields = ('id', 'owner', 'type', 'start_date', 'title', 'preview', 'created_at', 'updated_at')
+        read_only_fields = fields
+
 
 # --- Notebook ---
+class NotebookReorderSerializer(serializers.Serializer):
+    """ページの並び替え要求（この順に position を 0, 1, 2... と振り直す。無いページは後ろに続く）"""
+    page_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+
+    def validate_page_ids(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("page_ids must not contain duplicates.")
+        return value
+
 class NotebookSerializer(serializers.ModelSerializer):
     cover = AssetRefSerializer(required=False, allow_null=True)
-    # ページIDのリストを含める（順序付き）
-    page_ids = serializers.SerializerMethodField()
+    # ページIDのリストを含める（順序付き）。NotebookViewSet が ArrayAgg で付ける ordered_page_ids をそのまま出す
+    page_ids = serializers.ListField(child=serializers.UUIDField(), source='ordered_page_ids', read_only=True)
     class Meta:
         model = Notebook
-        fields = '__all__'
+        fields = ('id', 'cover', 'page_ids', 'schema_version', 'created_at', 'updated_at', 'deleted_at',
+                  'title', 'description', 'tags', 'view_settings', 'visibility', 'owner', 'pages')
         read_only_fields = ('id', 'owner', 'created_at', 'updated_at')
 
-    @extend_schema_field(serializers.ListField(child=serializers.UUIDField()))
-    def get_page_ids(self, obj):
-        # NotebookPage中間テーブルを使って順序通りにIDを取得
-        return list(obj.notebookpage_set.filter(
-            page__deleted_at__isnull=True).order_by('position').values_list('page_id', flat=True))
\ No newline at end of file
@@ -1,3 +1,180 @@
+from unittest import mock
+
+from botocore.exceptions import ClientError
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import views
+from .models import Notebook, NotebookPage, Page, User, UploadSession
+
+
+class FakeS3:
+    """list_objects_v2（Prefix / StartAfter / ページ分割）と head_object だけを真似る"""
+
+    def __init__(self, keys, page_size=1000):
+        self.keys = sorted(keys)
+        self.page_size = page_size
+        self.list_calls = 0
+        self.head_calls = 0
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix, StartAfter=''):
+        keys = [k for k in self.keys if k.startswith(Prefix) and k > StartAfter]
+        for i in range(0, max(len(keys), 1), self.page_size):
+            self.list_calls += 1
+            yield {'Contents': [{'Key': k} for k in keys[i:i + self.page_size]]}
+
+    def head_object(self, Bucket, Key):
+        self.head_calls += 1
+        if Key not in self.keys:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {}
+
+
+class UploadBatchConfirmTests(TestCase):
+    url = '/api/uploads/confirm-batch/'
+
+    def setUp(self):
+        self.user = User.objects.create_user('a@example.com', 'password123')
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.user)
+
+    def _session(self, key, status='issued'):
+        return UploadSession.objects.create(
+            user=self.user, purpose='sticker', s3_key=key, mime='image/png', status=status,
+            expires_at=timezone.now() + timezone.timedelta(hours=1),
+        )
+
+    def _post(self, s3, sessions):
+        with mock.patch.object(views, '_s3', return_value=s3):
+            return self.client.post(self.url, {'uploadSessionIds': [str(s.id) for s in sessions]}, format='json')
+
+    def test_splits_confirmed_and_missing(self):
+        prefix = f'users/{self.user.id}/sticker/'
+        uploaded = [self._session(f'{prefix}{c}.png') for c in 'bd']
+        not_uploaded = self._session(f'{prefix}c.png')
+        already = self._session(f'{prefix}a.png', status='confirmed')
+        other_user = UploadSession.objects.create(
+            user=User.objects.create_user('b@example.com', 'password123'),
+            purpose='sticker', s3_key='users/x/sticker/e.png', mime='image/png',
+            expires_at=timezone.now() + timezone.timedelta(hours=1),
+        )
+        s3 = FakeS3([f'{prefix}{c}.png' for c in 'bd'] + ['users/x/sticker/e.png'])
+
+        res = self._post(s3, uploaded + [not_uploaded, already, other_user])
+
+        self.assertEqual(res.status_code, 200)
+        body = res.json()
+        self.assertCountEqual(body['confirmed'], [str(s.id) for s in [already] + uploaded])
+        self.assertCountEqual(body['missing'], [str(not_uploaded.id), str(other_user.id)])
+        statuses = dict(UploadSession.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[s.id] for s in uploaded], ['confirmed', 'confirmed'])
+        self.assertEqual(statuses[not_uploaded.id], 'issued')
+        self.assertEqual(statuses[other_user.id], 'issued')
+
+    def test_large_history_falls_back_to_head_object(self):
+        prefix = f'users/{self.user.id}/sticker/'
+        sessions = [self._session(f'{prefix}{k}.png') for k in ('00', '99')]
+        # 2件の間に過去のアップロードが大量にある
+        s3 = FakeS3([f'{prefix}{i:02d}.png' for i in range(100)], page_size=2)
+
+        res = self._post(s3, sessions)
+
+        self.assertCountEqual(res.json()['confirmed'], [str(s.id) for s in sessions])
+        self.assertLessEqual(s3.list_calls + s3.head_calls, 2 * len(sessions))
+
+    def test_invalid_id_is_400(self):
+        # ListField のエラーは {0: [...]} の形（int キー）で返る
+        res = self.client.post(self.url, {'uploadSessionIds': ['nope']}, format='json')
+
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('0', res.json()['uploadSessionIds'])
+
+
+class NotebookTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('a@example.com', 'password123')
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(owner=self.user, title='nb')
+        self.pages = [Page.objects.create(owner=self.user, date='2024-01-01') for _ in range(3)]
+        for i, page in enumerate(self.pages):
+            NotebookPage.objects.create(notebook=self.notebook, page=page, position=i)
+        self.url = f'/api/notebooks/{self.notebook.id}/reorder/'
+
+    def _positions(self):
+        return list(
+            NotebookPage.objects.filter(notebook=self.notebook).order_by('position').values_list('page_id', 'position')
+        )
+
+    def test_full_list(self):
+        a, b, c = self.pages
+        res = self.client.post(self.url, {'pageIds': [str(c.id), str(a.id), str(b.id)]}, format='json')
+
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(self._positions(), [(c.id, 0), (a.id, 1), (b.id, 2)])
+
+    def test_partial_list_appends_the_rest(self):
+        a, b, c = self.pages
+        res = self.client.post(self.url, {'pageIds': [str(c.id), str(b.id)]}, format='json')
+
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(self._positions(), [(c.id, 0), (b.id, 1), (a.id, 2)])
+
+    def test_duplicate_ids_are_400(self):
+        a, b, c = self.pages
+        res = self.client.post(self.url, {'pageIds': [str(c.id), str(c.id)]}, format='json')
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self._positions(), [(a.id, 0), (b.id, 1), (c.id, 2)])
+
+    def test_page_ids_follow_position(self):
+        a, b, c = self.pages
+        NotebookPage.objects.filter(notebook=self.notebook, page=a).update(position=5)
+        Page.objects.filter(pk=b.pk).update(deleted_at=timezone.now())
+
+        res = self.client.get(f'/api/notebooks/{self.notebook.id}/')
+
+        self.assertEqual(res.json()['pageIds'], [str(c.id), str(a.id)])
+
+    def test_create_returns_empty_page_ids(self):
+        res = self.client.post('/api/notebooks/', {'title': 'new'}, format='json')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['pageIds'], [])
+        empty = self.client.get(f"/api/notebooks/{res.json()['id']}/")
+        self.assertEqual(empty.json()['pageIds'], [])
+
+
+class PageAppendTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('a@example.com', 'password123')
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.user)
+        self.notebook = Notebook.objects.create(owner=self.user, title='nb')
+
+    def test_appended_pages_get_consecutive_positions(self):
+        ids = []
+        for i in range(3):
+            res = self.client.post(
+                '/api/pages/',
+                {'date': f'2024-02-0{i + 1}', 'assets': {}, 'notebookId': str(self.notebook.id)}, format='json',
+            )
+            self.assertEqual(res.status_code, 201)
+            ids.append(res.json()['id'])
+
+        rows = NotebookPage.objects.filter(notebook=self.notebook).order_by('position')
+        self.assertEqual([(str(r.page_id), r.position) for r in rows], list(zip(ids, range(3))))
+
+    def test_other_users_notebook_is_not_linked(self):
+        other = Notebook.objects.create(owner=User.objects.create_user('b@example.com', 'password123'), title='nb')
+
+        res = self.client.post(
+            '/api/pages/', {'date': '2024-02-01', 'assets': {}, 'notebookId': str(other.id)}, format='json',
+        )
 
-# Create your tests here.
+        self.assertEqual(res.status_code, 201)
+        self.assertFalse(NotebookPage.objects.filter(notebook=other).exists())
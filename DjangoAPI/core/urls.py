@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import MeView, ScheduleViewSet, UploadView, StickerViewSet, PageViewSet, NotebookViewSet, UserRegistrationView, GuestIssueView
+from .views import MeView, ScheduleViewSet, UploadView, UploadBatchConfirmView, StickerViewSet, PageViewSet, NotebookViewSet, UserRegistrationView, GuestIssueView
 
 router = DefaultRouter()
 router.register(r'stickers', StickerViewSet, basename='sticker')
@@ -14,6 +14,8 @@ urlpatterns = [
     # Upload (Actionベース)
     #path('uploads/issue/', UploadView.as_view(), {'post': 'issue_upload'}, name='upload-issue'), # ※View側の実装微修正が必要
     # あるいは単純に View 内で分岐させるなら path('uploads/<str:action>/', ...)
+    # 複数まとめての完了確認（uploads/<str:action>/ より先に置く）
+    path('uploads/confirm-batch/', UploadBatchConfirmView.as_view(), name='upload-confirm-batch'),
     path('uploads/<str:action>/', UploadView.as_view(), name='upload'),
     path('auth/register/', UserRegistrationView.as_view(), name='register'),
     path('auth/register/', UserRegistrationView.as_view(), name='register'),
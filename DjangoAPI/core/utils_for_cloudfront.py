@@ -1,7 +1,8 @@
 import datetime
 import time
-import json
 import base64
+import orjson
+from functools import lru_cache
 
 from django.conf import settings
 from botocore.signers import CloudFrontSigner
@@ -10,26 +11,68 @@ from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import hashes
 from typing import Optional
 
-def _rsa_signer(message: bytes) -> bytes:
-    if settings.CLOUDFRONT_PRIVATE_KEY is None:
+@lru_cache(maxsize=None)
+def _private_key():
+    """秘密鍵の PEM パースはプロセスで1回だけ（署名ごとに ASN.1 を読まない）"""
+    if settings.CLOUDFRONT_PRIVATE_KEY is not None:
         private_key_pem = settings.CLOUDFRONT_PRIVATE_KEY.encode('utf-8')
-        private_key = serialization.load_pem_private_key(
-            private_key_pem,
-            password=None
-        )
     else:
         with open(settings.CLOUDFRONT_PRIVATE_KEY_PATH, "rb") as f:
-            private_key = serialization.load_pem_private_key(f.read(), password=None)
-    return private_key.sign(message, padding.PKCS1v15(), hashes.SHA1())
+            private_key_pem = f.read()
+    return serialization.load_pem_private_key(private_key_pem, password=None)
+
+
+@lru_cache(maxsize=None)
+def _url_prefix() -> str:
+    return f"https://{settings.CLOUDFRONT_DOMAIN}/"
+
+
+_HASH_ALGORITHMS = {"SHA1": hashes.SHA1, "SHA256": hashes.SHA256}
+
+
+@lru_cache(maxsize=None)
+def _hash_algorithm():
+    return _HASH_ALGORITHMS[settings.CLOUDFRONT_SIGNATURE_HASH]()
+
+
+def _rsa_signer(message: bytes) -> bytes:
+    return _private_key().sign(message, padding.PKCS1v15(), _hash_algorithm())
+
+
+@lru_cache(maxsize=None)
+def _signer() -> CloudFrontSigner:
+    return CloudFrontSigner(settings.CLOUDFRONT_PUBLIC_KEY_ID, _rsa_signer)
+
+# CloudFront 用の URL セーフ Base64（+ → -, = → _, / → ~）を1パスで置換する表
+_CF_B64_TRANS = bytes.maketrans(b'+=/', b'-_~')
+
+
+def _cf_b64(data: bytes) -> str:
+    return base64.b64encode(data).translate(_CF_B64_TRANS).decode('ascii')
+
+# 有効期限を丸める単位（秒）。同じ区間内なら同じキーの URL を使い回す
+SIGNED_URL_EXPIRY_BUCKET_SECONDS = 300
+
+
+@lru_cache(maxsize=4096)
+def _signed_url(s3_key: str, expiry_bucket: int) -> str:
+    url = _url_prefix() + s3_key.lstrip('/')
+    # 区間の終端を期限にする（要求された期限より短くはならない）
+    date_less_than = datetime.datetime.fromtimestamp(
+        (expiry_bucket + 1) * SIGNED_URL_EXPIRY_BUCKET_SECONDS, tz=datetime.timezone.utc
+    )
+    signed_url = _signer().generate_presigned_url(url, date_less_than=date_less_than)
+    if settings.CLOUDFRONT_SIGNATURE_HASH != "SHA1":
+        # 省略時は SHA1 として検証されるので、SHA1 以外のときだけ明示する
+        signed_url += f"&Hash-Algorithm={settings.CLOUDFRONT_SIGNATURE_HASH}"
+    return signed_url
+
 
 def generate_cf_signed_url(s3_key: str, expires_seconds: Optional[int] = None) -> str:
     expires = expires_seconds or settings.CLOUDFRONT_URL_EXPIRES_SECONDS
-    url = f"https://{settings.CLOUDFRONT_DOMAIN}/{s3_key.lstrip('/')}"
-    signer = CloudFrontSigner(settings.CLOUDFRONT_PUBLIC_KEY_ID, _rsa_signer)
-    return signer.generate_presigned_url(
-        url,
-        date_less_than=datetime.datetime.now() + datetime.timedelta(seconds=expires),
-    )
+    # 一覧で同じキーが何度も出てきても RSA 署名は区間ごとに1回だけ
+    expiry_bucket = (int(time.time()) + expires) // SIGNED_URL_EXPIRY_BUCKET_SECONDS
+    return _signed_url(s3_key, expiry_bucket)
 
 def get_cloudfront_signed_cookies(url_prefix, expire_minutes=60):
     """
@@ -48,30 +91,23 @@ def get_cloudfront_signed_cookies(url_prefix, expire_minutes=60):
             }
         ]
     }
-    # JSON -> 文字列 -> 空白削除
-    policy_json = json.dumps(policy_dict).replace(" ", "")
+    # JSON (bytes)。orjson は空白を入れないので、そのまま署名対象の正規形になる
+    policy_json = orjson.dumps(policy_dict)
     
     # Base64エンコード (URLセーフ)
-    policy_b64 = base64.b64encode(policy_json.encode('utf-8')).decode('utf-8').replace('+', '-').replace('=', '_').replace('/', '~')
+    policy_b64 = _cf_b64(policy_json)
 
     # 署名の作成
-    private_key_pem = settings.CLOUDFRONT_PRIVATE_KEY.encode('utf-8')
-    private_key = serialization.load_pem_private_key(
-        private_key_pem,
-        password=None
-    )
-    
-    signature = private_key.sign(
-        policy_json.encode('utf-8'),
-        padding.PKCS1v15(),
-        hashes.SHA1()
-    )
+    signature = _rsa_signer(policy_json)
     
-    signature_b64 = base64.b64encode(signature).decode('utf-8').replace('+', '-').replace('=', '_').replace('/', '~')
+    signature_b64 = _cf_b64(signature)
 
-    return {
+    cookies = {
         'CloudFront-Policy': policy_b64,
         'CloudFront-Signature': signature_b64,
         'CloudFront-Key-Pair-Id': settings.CLOUDFRONT_KEY_PAIR_ID,
         'Expires': expires
     }
+    if settings.CLOUDFRONT_SIGNATURE_HASH != "SHA1":
+        cookies['CloudFront-Hash-Algorithm'] = settings.CLOUDFRONT_SIGNATURE_HASH
+    return cookies
@@ -3,18 +3,95 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import action
 from django.conf import settings
-from .models import Schedule, User, Sticker, Page, Notebook, NotebookPage,UploadSession
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields import ArrayField
+from django.db import transaction
+from django.db.models import Max, OuterRef, Prefetch, Subquery, UUIDField, Value
+from django.db.models.functions import Coalesce
+from .models import Schedule, Sticker, Page, Notebook, NotebookPage,UploadSession
 from .serializers import (
     ScheduleSerializer, UserRegistrationSerializer, UserSerializer, StickerSerializer, PageSerializer, NotebookSerializer,
-    UploadIssueSerializer, UploadConfirmSerializer, GuestIssueResponseSerializer
+    PageReadSerializer, ScheduleReadSerializer, NotebookReorderSerializer,
+    PageSummarySerializer, ScheduleSummarySerializer,
+    UploadIssueSerializer, UploadConfirmSerializer, UploadBatchConfirmSerializer, UploadBatchConfirmResponseSerializer,
+    GuestIssueResponseSerializer
 )
 from drf_spectacular.utils import extend_schema, extend_schema_view
 
 from django.utils import timezone
+from collections import defaultdict
+from functools import lru_cache
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import boto3
+import logging
 import uuid
 import os
 
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _s3():
+    """S3 クライアントはプロセスで1つだけ作る（サービス定義の読み込み・認証情報の解決を毎回しない）"""
+    # addressing_style を固定し、署名付き URL の生成ごとにバケット名からの判定をさせない
+    return boto3.client('s3',
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_S3_REGION_NAME,
+        config=Config(
+            signature_version='s3v4',
+            s3={'addressing_style': 'virtual'},
+            max_pool_connections=50,
+        ),
+    )
+
+
+def _s3_object_exists(key):
+    try:
+        _s3().head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+    except ClientError:
+        return False
+    return True
+
+
+def _existing_s3_keys(keys):
+    """
+    keys のうち S3 に実体があるものを返す。
+    キーのディレクトリ（users/{user_id}/{purpose}/）ごとに、最小キーから最大キーまでの範囲だけ
+    list_objects_v2 で読む。読んだページ数が未確認のキー数に追いついたら残りは head_object にする
+    （過去のアップロードが多いユーザーでも、1件ずつ head_object するより大きくは増えない）
+    """
+    groups = defaultdict(list)
+    for key in keys:
+        groups[key.rpartition('/')[0] + '/'].append(key)
+
+    existing = set()
+    paginator = _s3().get_paginator('list_objects_v2')
+    for prefix, group in groups.items():
+        pending = set(group)
+        last_key = max(group)
+        # StartAfter はそのキー自身を含まないので、最小キーの末尾1文字を落とした位置から読む
+        pages = paginator.paginate(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME, Prefix=prefix, StartAfter=min(group)[:-1],
+        )
+        listed = False
+        for page_count, page in enumerate(pages, start=1):
+            contents = page.get('Contents', ())
+            found = pending.intersection(obj['Key'] for obj in contents)
+            existing |= found
+            pending -= found
+            if not pending or (contents and contents[-1]['Key'] >= last_key):
+                listed = True
+                break
+            if page_count >= len(pending):
+                break
+        else:
+            listed = True
+        if not listed:
+            existing.update(key for key in pending if _s3_object_exists(key))
+    return existing
+
 # --- 1. User API ---
 class MeView(generics.RetrieveUpdateAPIView):
     """自分のプロフィール取得・更新"""
@@ -79,12 +156,7 @@ class UploadView(views.APIView):
         key = f"users/{request.user.id}/{data['purpose']}/{uuid.uuid4()}{ext}"
 
         # Presigned URL生成
-        s3 = boto3.client('s3', 
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
-        url = s3.generate_presigned_url(
+        url = _s3().generate_presigned_url(
             'put_object',
             Params={
                 'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 
@@ -113,27 +185,65 @@ class UploadView(views.APIView):
         serializer.is_valid(raise_exception=True)
         session_id = serializer.validated_data['upload_session_id']
 
-        try:
-            session = UploadSession.objects.get(id=session_id, user=request.user)
-        except UploadSession.DoesNotExist:
+        # モデルは組み立てず、判定に使う2列だけ読む
+        session = (
+            UploadSession.objects.filter(id=session_id, user=request.user)
+            .values_list('s3_key', 'status').first()
+        )
+        if session is None:
             return Response({'error': 'Session not found'}, status=404)
+        s3_key, session_status = session
+
+        # 確認済みなら S3 への問い合わせも UPDATE もしない（再送・二重タップ）
+        if session_status == 'confirmed':
+            return Response({'status': 'confirmed'})
 
         # S3上の存在確認（Head Object）
-        s3 = boto3.client('s3', 
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
         try:
-            s3.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=session.s3_key)
+            _s3().head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=s3_key)
         except:
             return Response({'error': 'File not found in S3'}, status=400)
 
-        session.status = 'confirmed'
-        session.save()
+        # 全列を書き戻す save() ではなく status / updated_at だけ UPDATE する
+        UploadSession.objects.filter(id=session_id).update(status='confirmed', updated_at=timezone.now())
         return Response({'status': 'confirmed'})
 
 
+class UploadBatchConfirmView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=UploadBatchConfirmSerializer,
+        responses={200: UploadBatchConfirmResponseSerializer},
+        description="複数のアップロードの完了をまとめて確認します。",
+    )
+    def post(self, request, *args, **kwargs):
+        """複数セッションの完了確認（S3 の確認は _existing_s3_keys でまとめて行う）"""
+        serializer = UploadBatchConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session_ids = serializer.validated_data['upload_session_ids']
+
+        sessions = list(
+            UploadSession.objects.filter(id__in=session_ids, user=request.user).only('id', 's3_key', 'status')
+        )
+        # 確認済みのものは S3 を見ずにそのまま confirmed として返す
+        already_confirmed_ids = [session.id for session in sessions if session.status == 'confirmed']
+        sessions = [session for session in sessions if session.status != 'confirmed']
+
+        existing_keys = _existing_s3_keys([session.s3_key for session in sessions])
+        confirmed_ids = [session.id for session in sessions if session.s3_key in existing_keys]
+        # 行ごとの save() ではなく UPDATE 1本で確定する（update() は auto_now を通らないので明示）
+        if confirmed_ids:
+            UploadSession.objects.filter(id__in=confirmed_ids).update(status='confirmed', updated_at=timezone.now())
+
+        confirmed_ids = already_confirmed_ids + confirmed_ids
+        confirmed = set(confirmed_ids)
+        return Response({
+            'confirmed': [str(session_id) for session_id in confirmed_ids],
+            'missing': [str(session_id) for session_id in session_ids if session_id not in confirmed],
+        })
+
+
 # --- 3. Sticker API ---
 class StickerViewSet(viewsets.ModelViewSet):
     queryset = Sticker.objects.all()
@@ -142,7 +252,12 @@ class StickerViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # 自分のステッカーのみ
-        return Sticker.objects.filter(owner=self.request.user).order_by('-created_at')
+        qs = Sticker.alive.filter(owner=self.request.user)
+        # ?tag=foo（tags の GIN インデックスが効く @> で絞り込む）
+        tag = self.request.query_params.get('tag')
+        if tag:
+            qs = qs.filter(tags__contains=[tag])
+        return qs.order_by('-created_at')
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -152,40 +267,53 @@ class PageViewSet(viewsets.ModelViewSet):
     queryset = Page.objects.all()
     serializer_class = PageSerializer
     permission_classes = [IsAuthenticated]
-    
+
+    # (クエリパラメータ, lookup)
+    DATE_FILTERS = (('year', 'date__year'), ('month', 'date__month'), ('day', 'date__day'))
+
+    def get_serializer_class(self):
+        # 読み取りは検証なしの Serializer、書き込みは従来どおり検証する
+        if self.action in ('list', 'retrieve'):
+            return PageReadSerializer
+        if self.action == 'summary':
+            return PageSummarySerializer
+        return PageSerializer
+
     def perform_destroy(self, instance):
-        # 物理削除ではなく、論理削除を行う
-        instance.deleted_at = timezone.now()
-        instance.save()
+        # 物理削除ではなく、論理削除を行う（BaseModel.delete）
+        instance.delete()
 
     def get_queryset(self):
-        # 1. 基本のクエリセット（自分のページ）
-        if self.request.user.is_authenticated:
-            queryset = Page.objects.filter(owner=self.request.user)
-        else:
-            # デモ用（全件）
-            queryset = Page.objects.all()
-        
-        queryset = queryset.filter(deleted_at__isnull=True)
+        # 1. 基本のクエリセット（自分のページ）。未ログインは IsAuthenticated で 401 になる
+        queryset = Page.alive.filter(owner=self.request.user)
 
         # 2. クエリパラメータによるフィルタリング
-        # ?year=2024
-        year = self.request.query_params.get('year')
-        if year:
-            queryset = queryset.filter(date__year=year)
-        # ?month=2 (yearと併用推奨だが、単独でも動作可能)
-        month = self.request.query_params.get('month')
-        if month:
-            queryset = queryset.filter(date__month=month)
-        # ?day=15
-        day = self.request.query_params.get('day')
-        if day:
-            queryset = queryset.filter(date__day=day)
-
-        print("Filtered queryset count:",queryset)
+        # ?year=2024 / ?month=2 (yearと併用推奨だが、単独でも動作可能) / ?day=15
+        # 条件はまとめて1回の filter() に渡す（QuerySet の clone を1回で済ませる）
+        params = self.request.query_params
+        filters = {lookup: params[key] for key, lookup in self.DATE_FILTERS if params.get(key)}
+        # ?tag=foo
+        tag = params.get('tag')
+        if tag:
+            filters['tags__contains'] = [tag]
+        if filters:
+            queryset = queryset.filter(**filters)
+
+        if self.action == 'summary':
+            # 要約に出す列だけ読む（scene_data などの巨大な JSON を DB から運ばない）
+            queryset = queryset.only(*PageSummarySerializer.Meta.fields)
+
         # 日付順にソートして返す
         return queryset.order_by('-date')
 
+    # GET /api/pages/summary/?year=2024&month=2
+    @extend_schema(responses=PageSummarySerializer(many=True))
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """一覧と同じ絞り込みで、メタデータだけを返す（カレンダー表示など向け）"""
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        return Response(serializer.data)
+
     def perform_create(self, serializer):
 
         page = serializer.save(owner=self.request.user)
@@ -194,21 +322,28 @@ class PageViewSet(viewsets.ModelViewSet):
         notebook_id = self.request.data.get('notebook_id')
         if notebook_id:
             try:
-                # Notebookを取得
-                notebook = Notebook.objects.get(id=notebook_id)
-                
-                # 中間テーブルに登録 (末尾に追加)
-                last_position = NotebookPage.objects.filter(notebook=notebook).count()
-                NotebookPage.objects.create(
-                    notebook=notebook,
-                    page=page,
-                    position=last_position
-                )
-                print(f"Page {page.id} added to Notebook {notebook.id}")
+                with transaction.atomic():
+                    # 自分のノートだけ。updated_at の UPDATE で存在確認と行ロックを1本で済ませる
+                    # （ロックで同時に追加されても position が重ならない）
+                    if not Notebook.alive.filter(id=notebook_id, owner=self.request.user).update(updated_at=timezone.now()):
+                        raise Notebook.DoesNotExist
+
+                    # 中間テーブルに登録 (末尾に追加)
+                    # position は INSERT の中で MAX(position) + 1 を (notebook, position) インデックスから読む
+                    next_position = (
+                        NotebookPage.objects.filter(notebook_id=notebook_id).order_by()
+                        .values('notebook_id').annotate(next=Max('position') + 1).values('next')
+                    )
+                    NotebookPage.objects.create(
+                        notebook_id=notebook_id,
+                        page=page,
+                        position=Coalesce(Subquery(next_position), 0)
+                    )
+                logger.debug("Page %s added to Notebook %s", page.id, notebook_id)
             except Notebook.DoesNotExist:
-                print(f"Notebook {notebook_id} not found.")
-            except Exception as e:
-                print(f"Error linking page to notebook: {e}")
+                logger.warning("Notebook %s not found.", notebook_id)
+            except Exception:
+                logger.exception("Error linking page to notebook")
 
 
 # --- Schedule API ---
@@ -218,25 +353,39 @@ class ScheduleViewSet(viewsets.ModelViewSet):
     serializer_class = ScheduleSerializer
     permission_classes = [IsAuthenticated] # または AllowAny
 
+    def get_serializer_class(self):
+        if self.action in ('list', 'retrieve'):
+            return ScheduleReadSerializer
+        if self.action == 'summary':
+            return ScheduleSummarySerializer
+        return ScheduleSerializer
+
     def get_queryset(self):
-        user = self.request.user if self.request.user.is_authenticated else User.objects.first()
-        qs = Schedule.objects.filter(owner=user)
-
-        # フィルタリング
-        type_param = self.request.query_params.get('type')
-        if type_param:
-            qs = qs.filter(type=type_param)
-            
-        start_date = self.request.query_params.get('start_date')
-        if start_date:
-            qs = qs.filter(start_date=start_date)
+        # 未ログインは IsAuthenticated で 401 になるので、先頭ユーザーへのフォールバックは引かない
+        qs = Schedule.alive.filter(owner=self.request.user)
+
+        # フィルタリング（?type=monthly / ?start_date=2024-02-01 をまとめて1回の filter() で）
+        params = self.request.query_params
+        filters = {key: params[key] for key in ('type', 'start_date') if params.get(key)}
+        if filters:
+            qs = qs.filter(**filters)
+
+        if self.action == 'summary':
+            qs = qs.only(*ScheduleSummarySerializer.Meta.fields)
 
         return qs.order_by('-start_date')
 
+    # GET /api/schedules/summary/?type=monthly
+    @extend_schema(responses=ScheduleSummarySerializer(many=True))
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """一覧と同じ絞り込みで、scene_data / events_data を除いたメタデータだけを返す"""
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        return Response(serializer.data)
+
     def perform_create(self, serializer):
         # ユーザー紐付け
-        user = self.request.user if self.request.user.is_authenticated else User.objects.first()
-        serializer.save(owner=user)
+        serializer.save(owner=self.request.user)
 
 
 # --- 5. Notebook API ---
@@ -246,10 +395,38 @@ class NotebookViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     #permission_classes = [AllowAny] # ★一時的に全員許可
     def get_queryset(self):
-        return Notebook.objects.filter(owner=self.request.user).order_by('-updated_at')
+        qs = Notebook.alive.filter(owner=self.request.user)
+        # ?tag=foo
+        tag = self.request.query_params.get('tag')
+        if tag:
+            qs = qs.filter(tags__contains=[tag])
+        if self.action == 'pages':
+            # 所有確認に使うだけなので、cover / view_settings などの列は読まない
+            qs = qs.only('id')
+        elif self.action != 'reorder':
+            # NotebookSerializer 用。一覧でも IN (...) 各1回で済む
+            qs = qs.select_related('owner').prefetch_related(
+                # pages（PK のリスト）用
+                Prefetch('pages', queryset=Page.objects.only('id')),
+            )
+            # page_ids 用（順序付き・論理削除を除外）。DB 側で配列にまとめ、行を Python に持ってこない
+            # ページ0件だと Subquery は NULL なので空配列にする
+            qs = qs.annotate(ordered_page_ids=Coalesce(
+                Subquery(
+                    NotebookPage.objects.filter(notebook_id=OuterRef('pk'), page__deleted_at__isnull=True)
+                    .values('notebook_id')
+                    .annotate(ids=ArrayAgg('page_id', ordering='position'))
+                    .values('ids')
+                ),
+                Value([]),
+                output_field=ArrayField(UUIDField()),
+            ))
+        return qs.order_by('-updated_at')
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        notebook = serializer.save(owner=self.request.user)
+        # 作ったばかりのノートにはページが無い（page_ids の集約を省く）
+        notebook.ordered_page_ids = []
 
     # ★追加: Notebook内のPage一覧を取得するアクション
     # GET /api/notebooks/{id}/pages/
@@ -258,12 +435,21 @@ class NotebookViewSet(viewsets.ModelViewSet):
         notebook = self.get_object() # 存在確認と権限チェック込み
         
         # NotebookPageを通してPageを取得し、Pageの日付でソート
-        # select_related でクエリを最適化
-        pages = Page.objects.filter(
-            notebookpage__notebook=notebook,
-            deleted_at__isnull=True  # ★追加: 論理削除されたページを除外
+        # 中間テーブルとの JOIN 1回で全ページを取る（owner などは PK のまま出すので追加クエリなし）
+        pages = Page.alive.filter(
+            notebookpage__notebook_id=notebook.id,  # ★ alive: 論理削除されたページを除外
         ).order_by('date')  # 日付の新しい順
-        
+
         # PageSerializerを使ってシリアライズ
-        serializer = PageSerializer(pages, many=True)
+        serializer = PageReadSerializer(pages, many=True)
         return Response(serializer.data)
+
+    # POST /api/notebooks/{id}/reorder/  body: {"pageIds": [...]}
+    @extend_schema(request=NotebookReorderSerializer, responses={204: None})
+    @action(detail=True, methods=['post'])
+    def reorder(self, request, pk=None):
+        notebook = self.get_object()
+        serializer = NotebookReorderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        notebook.reorder_pages(serializer.validated_data['page_ids'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
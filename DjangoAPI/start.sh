@@ -45,6 +45,8 @@ fi
 # ---------------------------------------------------
 
 echo "[start] gunicorn..."
+# S3 / DB の応答待ちでワーカーが止まらないよう、ワーカーごとにスレッドを持たせる（gthread）
 exec gunicorn config.wsgi:application \
   --bind "0.0.0.0:${PORT}" \
-  --workers "${WEB_CONCURRENCY:-2}"
+  --workers "${WEB_CONCURRENCY:-2}" \
+  --threads "${GUNICORN_THREADS:-4}"
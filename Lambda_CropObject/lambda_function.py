@@ -2,14 +2,22 @@ import os
 import json
 import base64
 import hashlib
+import shutil
+import tempfile
 from urllib.parse import urlparse, unquote
 
 
 import boto3
-import requests
+import urllib3
+from boto3.s3.transfer import TransferConfig
 
 os.environ['NUMBA_CACHE_DIR'] = '/tmp'
 os.environ['MPLCONFIGDIR'] = '/tmp'
+
+# rembg は上の環境変数を設定してから import する
+from PIL import Image
+from rembg import new_session, remove
+
 s3 = boto3.client("s3")
 
 OUTPUT_BUCKET = os.environ["OUTPUT_BUCKET"]                # 出力先バケット
@@ -17,6 +25,33 @@ OUTPUT_PREFIX = os.environ.get("OUTPUT_PREFIX", "removed/")  # 任意
 PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "")      # 例: https://assets.example.com  (空ならS3直)
 RETURN_PRESIGNED = os.environ.get("RETURN_PRESIGNED", "0") == "1"
 PRESIGNED_EXPIRES = int(os.environ.get("PRESIGNED_EXPIRES", "3600"))
+# PNG の zlib レベル（0-9）。サイズより CPU 時間を優先して既定は 1
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+
+# これを超えたら /tmp に逃がす（入出力とも）
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=SPOOL_MAX_BYTES, use_threads=True)
+
+# 画像取得用の HTTP プール。ウォーム起動では TLS 接続を使い回す
+HTTP = urllib3.PoolManager(
+    num_pools=4,
+    maxsize=8,
+    retries=urllib3.Retry(3, backoff_factor=0.2),
+    timeout=urllib3.Timeout(connect=3, read=30),
+)
+
+# ONNX セッションは初期化時に1回だけ作り、ウォーム起動では使い回す
+# （モデルは Dockerfile で U2NET_HOME に u2net.onnx として同梱済み）
+REMBG_SESSION = new_session("u2net")
+try:
+    # ダミー推論でセッション / カーネルを温めておく
+    remove(Image.new("RGB", (64, 64)), session=REMBG_SESSION)
+except Exception as e:
+    print(f"rembg warmup failed: {e}")
+
+class ImageFetchError(Exception):
+    """画像URLが 4xx/5xx を返した"""
+
 
 # 入力（API Gateway / Function URL / 直invoke）の差を吸収
 def _parse_payload(event):
@@ -39,23 +74,36 @@ def _safe_basename_from_url(url: str) -> str:
 
 def _make_output_key(image_url: str) -> str:
     # 衝突回避のためURLハッシュを混ぜる（同一URLなら同一keyにもできる）
-    h = hashlib.sha256(image_url.encode("utf-8")).hexdigest()[:12]
+    # 先頭6バイトだけ16進にする（hexdigest()[:12] と同じ値）
+    h = hashlib.sha256(image_url.encode("utf-8")).digest()[:6].hex()
     name = _safe_basename_from_url(image_url)
     return f"{OUTPUT_PREFIX}{name}-{h}.png"
 
-def _download_image(url: str) -> bytes:
+def _download_image(url: str):
     # presigned URL含めてHTTP GETできればOK
-    r = requests.get(url, timeout=30)
-    r.raise_for_status()
-    return r.content
-
-def _put_png(bucket: str, key: str, png_bytes: bytes):
-    s3.put_object(
-        Bucket=bucket,
-        Key=key,
-        Body=png_bytes,
-        ContentType="image/png",
-        CacheControl="public, max-age=31536000, immutable",
+    # 本文を丸ごと r.content に載せず、チャンクでスプールへ流す
+    r = HTTP.request("GET", url, preload_content=False)
+    try:
+        if r.status >= 400:
+            raise ImageFetchError(f"{r.status} {r.reason} for url: {url}")
+        buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        shutil.copyfileobj(r, buf)
+    finally:
+        r.release_conn()
+    buf.seek(0)
+    return buf
+
+def _put_png(bucket: str, key: str, png_fileobj):
+    png_fileobj.seek(0)
+    s3.upload_fileobj(
+        png_fileobj,
+        bucket,
+        key,
+        ExtraArgs={
+            "ContentType": "image/png",
+            "CacheControl": "public, max-age=31536000, immutable",
+        },
+        Config=TRANSFER_CONFIG,
     )
 
 def _s3_public_url(bucket: str, key: str) -> str:
@@ -75,7 +123,6 @@ def _presigned_get_url(bucket: str, key: str) -> str:
     )
 
 def lambda_handler(event, context):
-    from rembg import remove
     try:
         payload = _parse_payload(event)
         image_url = payload.get("image_url")
@@ -86,15 +133,18 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": "image_url is required"}, ensure_ascii=False),
             }
 
-        # 1) 画像取得（バイナリのまま扱う。decodeしない）
-        img_bytes = _download_image(image_url)
-
-        # 2) 背景除去（PNG相当のバイナリが返る）
-        out_png = remove(img_bytes)
+        # 1) 画像取得（スプールに書くだけ。bytes にはしない）
+        with _download_image(image_url) as src, \
+                tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as out_png:
+            # 2) 背景除去（PIL で渡せば PIL で返る。bytes 入力時と同じく PNG で書き出す）
+            with Image.open(src) as img:
+                cutout = remove(img, session=REMBG_SESSION)
+            cutout.save(out_png, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+            del cutout
 
-        # 3) S3保存
-        out_key = _make_output_key(image_url)
-        _put_png(OUTPUT_BUCKET, out_key, out_png)
+            # 3) S3保存
+            out_key = _make_output_key(image_url)
+            _put_png(OUTPUT_BUCKET, out_key, out_png)
 
         # 4) URL返却
         if RETURN_PRESIGNED:
@@ -111,7 +161,7 @@ def lambda_handler(event, context):
             ),
         }
 
-    except requests.HTTPError as e:
+    except (ImageFetchError, urllib3.exceptions.HTTPError) as e:
         return {
             "statusCode": 502,
             "headers": {"content-type": "application/json; charset=utf-8"},
@@ -0,0 +1,118 @@
+"""
+YOLO seg モデルを ONNX に書き出し、ONNX Runtime で静的 INT8 (QDQ) 量子化する。
+イメージのビルド前に手元で1回だけ実行する。
+
+    python export_onnx.py --model yolo26n-seg.pt --calib-dir ./calib --imgsz 640
+    python export_onnx.py --model yolo26n-seg.pt --fp32   # 量子化せず FP32 のまま
+    python export_onnx.py --model yolo26n-seg.pt --openvino --data coco128-seg.yaml
+
+出力 (例: yolo26n-seg.int8.onnx / yolo26n-seg.onnx) を LAMBDA_TASK_ROOT に置き、
+MODEL_NAME に指定すると lambda_function がそれを読む（Lambda_CropYOLO も同様）。
+実行環境には onnxruntime が必要。IMGSZ は書き出し時と同じ値にすること。
+
+--openvino は ultralytics の OpenVINO INT8 書き出し（NNCF で --data のデータセットを使って
+キャリブレーション）。出力ディレクトリ (例: yolo26n-seg_int8_openvino_model/) ごと
+LAMBDA_TASK_ROOT に置き、そのディレクトリ名を MODEL_NAME に指定する（実行環境に openvino が必要）。
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+import onnx
+from PIL import Image
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from ultralytics import YOLO
+
+
+def _letterbox(img, imgsz):
+    """ultralytics の前処理と同じく、縦横比を保って縮小し 114 で埋める"""
+    w, h = img.size
+    r = min(imgsz / w, imgsz / h)
+    nw, nh = round(w * r), round(h * r)
+    canvas = Image.new("RGB", (imgsz, imgsz), (114, 114, 114))
+    canvas.paste(img.resize((nw, nh), Image.BILINEAR), ((imgsz - nw) // 2, (imgsz - nh) // 2))
+    return canvas
+
+
+class ImageDirCalibrationReader(CalibrationDataReader):
+    """キャリブレーション用の画像ディレクトリを1枚ずつ NCHW float32 で返す"""
+
+    def __init__(self, calib_dir, input_name, imgsz, limit):
+        paths = sorted(
+            p for ext in ("jpg", "jpeg", "png", "webp")
+            for p in glob.glob(os.path.join(calib_dir, f"*.{ext}"))
+        )[:limit]
+        if not paths:
+            raise SystemExit(f"No calibration images in {calib_dir}")
+        self._paths = iter(paths)
+        self._input_name = input_name
+        self._imgsz = imgsz
+
+    def get_next(self):
+        path = next(self._paths, None)
+        if path is None:
+            return None
+        img = _letterbox(Image.open(path).convert("RGB"), self._imgsz)
+        x = np.asarray(img, dtype=np.float32).transpose(2, 0, 1)[None] / 255.0
+        return {self._input_name: np.ascontiguousarray(x)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=os.environ.get("MODEL_NAME", "yolo26n-seg.pt"))
+    parser.add_argument("--calib-dir")
+    parser.add_argument("--fp32", action="store_true", help="量子化せず FP32 の ONNX だけ書き出す")
+    parser.add_argument("--openvino", action="store_true", help="ONNX ではなく OpenVINO の INT8 モデルを書き出す")
+    parser.add_argument("--data", default="coco128-seg.yaml", help="--openvino のキャリブレーション用データセット")
+    parser.add_argument("--imgsz", type=int, default=int(os.environ.get("IMGSZ", "640")))
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.openvino:
+        # VNNI / AMX / Arm sdot の INT8 演算を OpenVINO ランタイムに任せる
+        print(YOLO(args.model).export(format="openvino", int8=True, imgsz=args.imgsz, data=args.data))
+        return
+
+    if not args.fp32 and not args.calib_dir:
+        parser.error("--calib-dir is required unless --fp32 is given")
+
+    # 1) FP32 ONNX（固定サイズ）
+    # simplify=True で定数畳み込み・不要ノード削除まで済ませておく（ORT の最適化が効きやすい）
+    fp32_path = YOLO(args.model).export(format="onnx", imgsz=args.imgsz, half=False, dynamic=False, simplify=True)
+    if args.fp32:
+        print(fp32_path)
+        return
+    base, _ = os.path.splitext(fp32_path)
+    prep_path = f"{base}.prep.onnx"
+    int8_path = f"{base}.int8.onnx"
+
+    # 2) 量子化前の形状推論 / グラフ整理
+    quant_pre_process(fp32_path, prep_path)
+
+    # 3) 静的 INT8 量子化（QDQ, チャネル別）
+    input_name = onnx.load(prep_path, load_external_data=False).graph.input[0].name
+    quantize_static(
+        prep_path,
+        int8_path,
+        ImageDirCalibrationReader(args.calib_dir, input_name, args.imgsz, args.limit),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        reduce_range=False,
+    )
+
+    # ultralytics が task / names / imgsz を読むメタデータを引き継ぐ
+    src, dst = onnx.load(fp32_path), onnx.load(int8_path)
+    del dst.metadata_props[:]
+    dst.metadata_props.extend(src.metadata_props)
+    onnx.save(dst, int8_path)
+
+    os.remove(prep_path)
+    print(int8_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,34 @@
 import base64
 import json
 import os
-import io
+import platform
+
+# ---- スレッド数（Lambda_CropYOLO と同じ。torch などの import より前に決める） ----
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", os.cpu_count() or 2))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+
 import boto3
+import cv2
 import numpy as np
-from PIL import Image
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+import torch
 from ultralytics import YOLO
 from urllib.parse import urlparse
 
-s3 = boto3.client("s3")
+# 物体ごとのアップロードを並列に投げるので、接続プールを広げておく
+# keep-alive で warm 起動時は TLS ハンドシェイクを省き、リトライは短めに
+s3 = boto3.client(
+    "s3",
+    config=Config(
+        max_pool_connections=16,
+        retries={"max_attempts": 2, "mode": "standard"},
+        tcp_keepalive=True,
+        s3={"addressing_style": "virtual"},
+    ),
+)
 
 # ---- 環境変数から設定を取得 ----
 MODEL_NAME = os.environ.get("MODEL_NAME", "yolo26n-seg.pt")
@@ -22,10 +41,83 @@ IOU_THRES = float(os.environ.get("IOU_THRESHOLD", "0.45"))
 MAX_DET = int(os.environ.get("MAX_DET", "10"))
 IMGSZ = int(os.environ.get("IMGSZ", "640"))
 RETINA_MASKS = os.environ.get("RETINA_MASKS", "true").lower() == "true"
+# PNG の zlib レベル（0-9）。サイズより CPU 時間を優先して既定は 1
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+# TORCH_COMPILE / TORCH_COMPILE_MODE は Lambda_CropYOLO と同じ（.pt のときだけ, 既定は無効）
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "false").lower() == "true"
+TORCH_COMPILE_MODE = os.environ.get("TORCH_COMPILE_MODE", "default")
+
+# ---- CPU 推論の設定 ----
+torch.set_num_threads(TORCH_THREADS)
+torch.set_num_interop_threads(1)
+torch.backends.mkldnn.enabled = True
+
+
+def _cpu_supports_bf16():
+    """Lambda_CropYOLO と同じ判定（Graviton3 の bf16 / x86 の AVX-512 BF16・AMX）"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    if platform.machine() == "aarch64":
+        return " bf16" in flags
+    if torch.backends.cpu.get_cpu_capability() != "AVX512":
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+# USE_BF16: auto（既定, CPU を見て判定） / true / false
+_bf16_env = os.environ.get("USE_BF16", "auto").lower()
+USE_BF16 = _cpu_supports_bf16() if _bf16_env == "auto" else _bf16_env == "true"
 
 # モデルのロード
+# MODEL_NAME に export_onnx.py で作った *.int8.onnx を指定すると ONNX Runtime で推論する
 MODEL_PATH = os.path.join(os.environ.get("LAMBDA_TASK_ROOT", "/var/task"), MODEL_NAME)
-model = YOLO(MODEL_PATH)
+model = YOLO(MODEL_PATH, task="segment")
+
+# 推論パラメータはロード時に1回だけ組み立てる
+# conf は predict() 側の既定値 (0.25) が overrides より優先されるため、呼び出し時にも渡す
+PREDICT_ARGS = dict(
+    conf=CONF_THRES,
+    iou=IOU_THRES,
+    max_det=MAX_DET,
+    imgsz=IMGSZ,
+    retina_masks=RETINA_MASKS,
+    verbose=False,
+)
+model.overrides.update(PREDICT_ARGS)
+
+
+def _predict(source):
+    """環境変数のパラメータで YOLO 推論する"""
+    # ultralytics は numpy 配列を BGR として扱うので、cv2 でデコードした配列をそのまま渡す
+    sources = [source]
+    predictor = model.predictor
+    with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=USE_BF16):
+        if predictor is None:
+            return model(sources, **PREDICT_ARGS)
+        # 2回目以降は前処理 → 推論 → 後処理を直接呼ぶ（Lambda_CropYOLO の _predict と同じ）
+        im = predictor.preprocess(sources)
+        preds = predictor.inference(im)
+        predictor.batch = ([""] * len(sources), sources, [""] * len(sources))
+        return predictor.postprocess(preds, im, sources)
+
+
+def _compile_predictor_model():
+    """Lambda_CropYOLO と同じ（AutoBackend 内の nn.Module を差し替える）"""
+    backend = model.predictor.model
+    backend.model = torch.compile(backend.model, mode=TORCH_COMPILE_MODE, fullgraph=False, dynamic=False)
+
+
+# 初期化時にダミー画像で1回推論し、predictor の構築とカーネル選択を済ませておく
+try:
+    _predict(np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8))
+    if TORCH_COMPILE and MODEL_PATH.endswith(".pt"):
+        _compile_predictor_model()
+        _predict(np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8))
+except Exception as e:
+    print(f"Warmup failed: {str(e)}")
 
 def lambda_handler(event, context):
     try:
@@ -35,35 +127,45 @@ def lambda_handler(event, context):
         bucket, key = _parse_s3_event(event)
         response = s3.get_object(Bucket=bucket, Key=key)
         img_bytes = response['Body'].read()
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+        # PIL を経由せず BGR の配列に直接デコードする
+        # （PIL 版と同じく EXIF の向きは適用しない）
+        img_np = cv2.imdecode(
+            np.frombuffer(img_bytes, np.uint8),
+            cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION,
+        )
+        if img_np is None:
+            raise ValueError("Failed to decode image")
         
         # 2. YOLO推論 (環境変数のパラメータを適用)
-        results = model.predict(
-            source=img,
-            conf=CONF_THRES,
-            iou=IOU_THRES,
-            max_det=MAX_DET,
-            imgsz=IMGSZ,
-            retina_masks=RETINA_MASKS
-        )
+        results = _predict(img_np)
         
         result = results[0]
         s3_urls = []
 
         # 3. 検出された全物体をループで処理
         if hasattr(result, 'masks') and result.masks is not None:
-            for mask_data in result.masks.data:
-                mask_np = mask_data.cpu().numpy()
-                
-                # 背景透過処理
-                out_png_bytes = _apply_mask_to_image(img, mask_np)
-                
-                # 結果をS3に保存 (保存先バケットは環境変数または入力と同じもの)
-                dest_bucket = DEFAULT_BUCKET or bucket
-                dest_key = f"{S3_PREFIX}{uuid.uuid4().hex}.png"
-                
-                url = _put_to_s3(out_png_bytes, dest_bucket, dest_key)
-                s3_urls.append(url)
+            masks = result.masks.data
+            # アップロードはスレッドに渡し、次のマスクの合成・URL 署名と重ねる
+            with ThreadPoolExecutor(max_workers=max(1, min(8, len(masks)))) as ex:
+                futures = []
+                for mask_data in masks:
+                    # BF16 のままだと numpy に変換できないので float32 に戻す
+                    mask_np = mask_data.float().cpu().numpy()
+
+                    # 背景透過処理
+                    out_png_bytes = _apply_mask_to_image(img_np, mask_np)
+
+                    # 結果をS3に保存 (保存先バケットは環境変数または入力と同じもの)
+                    dest_bucket = DEFAULT_BUCKET or bucket
+                    dest_key = f"{S3_PREFIX}{uuid.uuid4().hex}.png"
+
+                    futures.append(ex.submit(_put_to_s3, out_png_bytes, dest_bucket, dest_key))
+                    # 署名はネットワーク不要なので、PUT の完了を待たずにここで作る
+                    s3_urls.append(_presign(dest_bucket, dest_key))
+
+                # 全件のアップロード完了（と失敗時の例外）を待つ
+                for f in futures:
+                    f.result()
 
         # 4. JSONレスポンス (URLのリストを返す)
         return {
@@ -102,26 +204,33 @@ def _parse_s3_event(event):
     
     raise ValueError("Event must contain s3_url or both bucket and key")
 
-def _apply_mask_to_image(original_img, mask_np):
+def _apply_mask_to_image(original_bgr, mask_np):
     """マスクを適用して透過PNGを生成"""
-    # マスクを元画像サイズにリサイズ
-    mask_img = Image.fromarray((mask_np * 255).astype(np.uint8)).resize(original_img.size, resample=Image.BILINEAR)
-    
-    rgba_img = original_img.copy().convert("RGBA")
-    rgba_img.putalpha(mask_img)
-    
-    buf = io.BytesIO()
-    rgba_img.save(buf, format="PNG")
-    return buf.getvalue()
+    h, w = original_bgr.shape[:2]
+    mask_u8 = (mask_np * 255).astype(np.uint8)
+    # マスクを元画像サイズにリサイズ（retina_masks 時は元から同サイズ）
+    if mask_u8.shape[:2] != (h, w):
+        mask_u8 = cv2.resize(mask_u8, (w, h), interpolation=cv2.INTER_LINEAR)
+
+    # BGRA を1回だけ確保して BGR とアルファを書き込む
+    bgra = np.empty((h, w, 4), dtype=np.uint8)
+    bgra[..., :3] = original_bgr
+    bgra[..., 3] = mask_u8
+
+    # libpng で直接エンコード（PNG 上は RGBA として書かれる）
+    ok, buf = cv2.imencode(".png", bgra, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESS_LEVEL])
+    if not ok:
+        raise ValueError("Failed to encode PNG")
+    return buf.tobytes()
 
 def _put_to_s3(buffer, bucket, key):
-    """S3にアップロードして署名付きURLを返す"""
+    """S3にアップロードする"""
     s3.put_object(Bucket=bucket, Key=key, Body=buffer, ContentType="image/png")
-    
-    # 署名付きURLの生成 (1時間有効)
-    url = s3.generate_presigned_url(
+
+def _presign(bucket, key):
+    """署名付きURLの生成 (1時間有効)"""
+    return s3.generate_presigned_url(
         "get_object",
         Params={"Bucket": bucket, "Key": key},
         ExpiresIn=3600
-    )
-    return url
\ No newline at end of file
+    )
\ No newline at end of file
@@ -1,42 +1,108 @@
 import os
+import platform
 import io
 import json
+import logging
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
+# ---- スレッド数（Lambda_CropYOLO と同じ。torch などの import より前に決める） ----
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", os.cpu_count() or 2))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+
 import boto3
+from botocore.config import Config
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 import numpy as np
+import cv2
 
+import torch
 from ultralytics import YOLO
 
+torch.set_num_threads(TORCH_THREADS)
+torch.set_num_interop_threads(1)
+
 # ---- Env ----
 S3_BUCKET = os.environ["S3_BUCKET"]
 S3_PREFIX = os.environ.get("S3_PREFIX", "cutouts/")
 PRESIGN_EXPIRES = int(os.environ.get("PRESIGN_EXPIRES", "3600"))
 YOLO_CONFIG_DIR= os.environ.get("YOLO_CONFIG_DIR", "/temp/Ultralytics/")  # モデル配置ディレクトリ
+# PNG の zlib レベル（0-9）。サイズより CPU 時間を優先して既定は 1
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+# 「最も目立つ」インスタンスの候補にする conf 上位の件数
+SALIENT_TOPK = int(os.environ.get("SALIENT_TOPK", "5"))
+
+# デバッグ出力は LOG_LEVEL=DEBUG のときだけ（既定では CloudWatch に書かない）
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "WARNING").upper())
 
 # yolo26n-seg.pt / yolo26s-seg.pt ... など（デフォルトは軽量nano）
 MODEL_NAME = os.environ.get("MODEL_NAME", "yolo26n-seg.pt")
 MODEL_PATH = os.path.join(os.environ.get("LAMBDA_TASK_ROOT", "/var/task"), MODEL_NAME)
 
 
+def _cpu_supports_bf16():
+    """Lambda_CropYOLO と同じ判定（Graviton3 の bf16 / x86 の AVX-512 BF16・AMX）"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    if platform.machine() == "aarch64":
+        return " bf16" in flags
+    if torch.backends.cpu.get_cpu_capability() != "AVX512":
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+# USE_BF16: auto（既定, CPU を見て判定） / true / false
+_bf16_env = os.environ.get("USE_BF16", "auto").lower()
+USE_BF16 = _cpu_supports_bf16() if _bf16_env == "auto" else _bf16_env == "true"
+
+
 
 
 
 # ---- Clients / Model (cold startでロード) ----
-s3 = boto3.client("s3")
+# keep-alive で warm 起動時は接続を使い回し、リトライは短めに
+s3 = boto3.client(
+    "s3",
+    config=Config(
+        max_pool_connections=4,
+        retries={"max_attempts": 2, "mode": "standard"},
+        tcp_keepalive=True,
+        s3={"addressing_style": "virtual"},
+    ),
+)
 model = YOLO(MODEL_PATH)
+# S3 PUT をバックグラウンドで走らせ、URL 組み立てなどと重ねる
+_executor = ThreadPoolExecutor(max_workers=1)
+# 画像取得の HTTP セッション（warm 起動時は取得元への接続を使い回す）
+_http = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.1, allowed_methods=frozenset({"GET"})),
+)
+_http.mount("https://", _http_adapter)
+_http.mount("http://", _http_adapter)
 
 
 
 
 def _download_image(url: str, timeout=15) -> Image.Image:
-    r = requests.get(url, timeout=timeout)
-    r.raise_for_status()
-    img = Image.open(io.BytesIO(r.content)).convert("RGB")
+    # r.content に全体を溜めず、ソケットから直接 PIL に読ませる
+    with _http.get(url, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        # convert() で読み切るまで接続を開いておく
+        img = Image.open(r.raw).convert("RGB")
     return img
 
 
@@ -48,12 +114,13 @@ def _pick_most_salient_instance(result) -> int:
         raise ValueError("No masks/boxes found")
 
     masks = result.masks.data  # torch.Tensor [N, H, W]
-    conf = result.boxes.conf   # torch.Tensor [N]
+    conf = result.boxes.conf.float()   # torch.Tensor [N]
 
-    # mask area
-    areas = masks.sum(dim=(1, 2)).float()  # [N]
-    scores = areas * conf.float()
-    idx = int(scores.argmax().item())
+    # 面積を数えるのは conf 上位 k 件のマスクだけ（N 枚全部の画素は読まない）
+    top_idx = conf.topk(min(SALIENT_TOPK, len(conf))).indices
+    areas = masks[top_idx].sum(dim=(1, 2)).float()  # [k]
+    scores = areas * conf[top_idx]
+    idx = int(top_idx[scores.argmax()].item())
     return idx
 
 
@@ -66,13 +133,15 @@ def _make_rgba_cutout(img_rgb: Image.Image, mask_2d: np.ndarray) -> Image.Image:
         mask_u8 = mask_2d
 
     # ✅ 重要：マスクを元画像サイズに合わせる
-    alpha = Image.fromarray(mask_u8, mode="L")
-    if alpha.size != img_rgb.size:
-        alpha = alpha.resize(img_rgb.size, resample=Image.NEAREST)
+    w, h = img_rgb.size
+    if mask_u8.shape != (h, w):
+        mask_u8 = cv2.resize(mask_u8, (w, h), interpolation=cv2.INTER_NEAREST)
 
-    rgba = img_rgb.convert("RGBA")
-    rgba.putalpha(alpha)
-    return rgba
+    # RGBA を1回だけ確保して RGB とアルファを書き込む（convert("RGBA") のコピーを作らない）
+    rgba_np = np.empty((h, w, 4), dtype=np.uint8)
+    rgba_np[:, :, :3] = np.asarray(img_rgb)
+    rgba_np[:, :, 3] = mask_u8
+    return Image.fromarray(rgba_np, mode="RGBA")
 
 
 def lambda_handler(event, context):
@@ -90,20 +159,22 @@ def lambda_handler(event, context):
         conf = float(event.get("conf", 0.25))
         imgsz = int(event.get("imgsz", 640))
 
-        results = model.predict(img, verbose=False, conf=conf, imgsz=imgsz)
+        with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=USE_BF16):
+            results = model.predict(img, verbose=False, conf=conf, imgsz=imgsz)
         r0 = results[0]
 
         # ---- debug ----
         boxes_n = 0 if r0.boxes is None else len(r0.boxes)
         masks_n = 0 if r0.masks is None else len(r0.masks)
-        print(json.dumps({
-            "model": MODEL_NAME,
-            "image_url": image_url,
-            "boxes": boxes_n,
-            "masks": masks_n,
-            "conf": conf,
-            "imgsz": imgsz,
-        }, ensure_ascii=False))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({
+                "model": MODEL_NAME,
+                "image_url": image_url,
+                "boxes": boxes_n,
+                "masks": masks_n,
+                "conf": conf,
+                "imgsz": imgsz,
+            }, ensure_ascii=False))
 
         # 0件なら「検出なし」で返す（エラー扱いにしない）
         if boxes_n == 0 or masks_n == 0:
@@ -119,20 +190,22 @@ def lambda_handler(event, context):
             }
 
         idx = _pick_most_salient_instance(r0)
-        mask = r0.masks.data[idx].cpu().numpy()
+        # BF16 のままだと numpy に変換できないので float32 に戻す
+        mask = r0.masks.data[idx].float().cpu().numpy()
 
         cutout = _make_rgba_cutout(img, mask)
-        tmp_path = f"/tmp/{uuid.uuid4().hex}.png"
-        cutout.save(tmp_path, format="PNG", optimize=True)
-
-        with open(tmp_path, "rb") as f:
-            s3.put_object(
-                Bucket=S3_BUCKET,
-                Key=out_key,
-                Body=f,
-                ContentType="image/png",
-                CacheControl="public, max-age=31536000, immutable",
-            )
+        # /tmp に書いて読み直さず、メモリ上でエンコードしてそのまま PUT する
+        buf = io.BytesIO()
+        cutout.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+
+        put_future = _executor.submit(
+            s3.put_object,
+            Bucket=S3_BUCKET,
+            Key=out_key,
+            Body=buf.getvalue(),
+            ContentType="image/png",
+            CacheControl="public, max-age=31536000, immutable",
+        )
 
         if return_mode == "s3":
             url = f"s3://{S3_BUCKET}/{out_key}"
@@ -143,6 +216,9 @@ def lambda_handler(event, context):
                 ExpiresIn=PRESIGN_EXPIRES,
             )
 
+        # アップロード完了（と失敗時の例外）を待ってから URL を返す
+        put_future.result()
+
         return {
             "statusCode": 200,
             "headers": {"content-type": "application/json"},
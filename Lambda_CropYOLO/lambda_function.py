@@ -1,39 +1,118 @@
 
 import base64
 import json
+import logging
 import os
+import platform
 import io
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# ---- スレッド数 ----
+# OpenMP / MKL はライブラリの import 時にスレッド数を読むので、numpy / cv2 / torch より前に決める
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", os.cpu_count() or 2))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+
 import boto3
+from botocore.config import Config
+import cv2
 import numpy as np
 from PIL import Image
-import urllib
+import urllib.request
 
+import torch
 # ultralytics
 from ultralytics import YOLO
 
-s3 = boto3.client("s3")
+# 小バッチなので演算スレッドは vCPU 数、inter-op は1本に絞る
+torch.set_num_threads(TORCH_THREADS)
+torch.set_num_interop_threads(1)
+
+# SQS のバッチでは PUT を並列に投げるので接続プールを広げ、keep-alive で接続を使い回す
+s3 = boto3.client(
+    "s3",
+    config=Config(
+        max_pool_connections=16,
+        retries={"max_attempts": 2, "mode": "standard"},
+        tcp_keepalive=True,
+        s3={"addressing_style": "virtual"},
+    ),
+)
+
+# S3 PUT 用のスレッド（SQS バッチではメッセージごとの PNG 化 + PUT もこのプールで回す）
+_put_executor = ThreadPoolExecutor(max_workers=8)
 
 # ---- Env ----
 S3_PREFIX = os.environ.get("S3_PREFIX", "cutouts/")
 PRESIGN_EXPIRES = int(os.environ.get("PRESIGN_EXPIRES", "3600"))
 YOLO_CONFIG_DIR= os.environ.get("YOLO_CONFIG_DIR", "/temp/Ultralytics")  # モデル配置ディレクトリ
+# PNG の zlib レベル（0-9）。サイズより CPU 時間を優先して既定は 1
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+# 推論の入力サイズ（長辺）。入力はこのサイズまで先に縮めてから渡す
+IMGSZ = int(os.environ.get("IMGSZ", "640"))
+# TORCH_COMPILE=true で predictor 内のネットワークを torch.compile する（.pt のときだけ, 既定は無効）
+# コンパイルは初回推論で走るので INIT のウォームアップで済ませる。CPU では CUDA Graph を使う
+# reduce-overhead は効かないので既定は "default"
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "false").lower() == "true"
+TORCH_COMPILE_MODE = os.environ.get("TORCH_COMPILE_MODE", "default")
+
+# デバッグ出力は LOG_LEVEL=DEBUG のときだけ（既定では CloudWatch に書かない）
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "WARNING").upper())
+
+
+def _cpu_supports_bf16():
+    """BF16 命令がある CPU でだけ BF16 を使う（無い CPU では逆に遅い）"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    if platform.machine() == "aarch64":
+        # Graviton3 以降（Features に bf16）
+        return " bf16" in flags
+    # x86: AVX-512 BF16 / AMX
+    if torch.backends.cpu.get_cpu_capability() != "AVX512":
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+# USE_BF16: auto（既定, CPU を見て判定） / true / false
+_bf16_env = os.environ.get("USE_BF16", "auto").lower()
+USE_BF16 = _cpu_supports_bf16() if _bf16_env == "auto" else _bf16_env == "true"
 
-# yolo26n-seg.pt / yolo26s-seg.pt ... など（デフォルトは軽量nano）
-MODEL_PATH = os.path.join(os.environ.get("LAMBDA_TASK_ROOT", "/var/task"), MODEL_NAME)
-model = YOLO(MODEL_PATH)
 DEFAULT_BUCKET = os.environ.get("BUCKET_NAME", "")
 
+# yolo26n-seg.pt / yolo26s-seg.pt ... など（デフォルトは軽量nano）
+MODEL_NAME = os.environ.get("MODEL_NAME", "yolo26n-seg.pt")
+MODEL_URL_BASE = "https://github.com/ultralytics/assets/releases/download/v8.4.0"
 
 
-MODEL_NAME = os.environ.get("MODEL_NAME", "yolo26n-seg.pt")
-TMP_MODEL_PATH = f"/tmp/{MODEL_NAME}"
+def _resolve_model_path(model_name: str) -> str:
+    """
+    イメージ同梱（Dockerfile で LAMBDA_TASK_ROOT に COPY 済み）の重みを優先する。
+    無いモデル名のときだけ GitHub から /tmp に1回落とし、同じ実行環境では使い回す。
+    """
+    bundled = os.path.join(os.environ.get("LAMBDA_TASK_ROOT", "/var/task"), model_name)
+    if os.path.exists(bundled):
+        return bundled
+
+    cached = os.path.join("/tmp", model_name)
+    if not os.path.exists(cached):
+        part = f"{cached}.part"
+        urllib.request.urlretrieve(f"{MODEL_URL_BASE}/{model_name}", part)
+        os.replace(part, cached)  # 途中で落ちても壊れたファイルを残さない
+    return cached
 
-if not os.path.exists(TMP_MODEL_PATH):
-    # GitHubからDLして /tmp に保存
-    url = f"https://github.com/ultralytics/assets/releases/download/v8.4.0/{MODEL_NAME}"
-    urllib.request.urlretrieve(url, TMP_MODEL_PATH)
 
-model = YOLO(TMP_MODEL_PATH)
+# モデルは INIT で1回だけロードする（失敗したら INIT ごと落として早く気付く）
+try:
+    MODEL_PATH = _resolve_model_path(MODEL_NAME)
+    model = YOLO(MODEL_PATH)
+except Exception as e:
+    print(f"Model load failed: {str(e)}")
+    raise
 
 
 
@@ -65,53 +144,105 @@ def _read_request_bytes(event) -> tuple[bytes, str | None]:
     return body.encode("utf-8"), (headers.get("x-s3-key") or None)
 
 
+def _decode_image(image_bytes: bytes):
+    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    return img, np.asarray(img)
+
+
+def _model_input(np_img):
+    """
+    縦横比を保って長辺を IMGSZ まで cv2 で縮め、ultralytics が期待する BGR にする。
+    合成には元解像度の np_img を使い、マスクは _result_to_rgba_png で元サイズに戻す。
+    """
+    h, w = np_img.shape[:2]
+    r = IMGSZ / max(h, w)
+    if r < 1:
+        np_img = cv2.resize(np_img, (round(w * r), round(h * r)), interpolation=cv2.INTER_AREA)
+    # ultralytics は numpy 配列を BGR として扱う（RGB のまま渡すと色がずれて精度が落ちる）
+    return cv2.cvtColor(np_img, cv2.COLOR_RGB2BGR)
+
+
+def _predict(np_imgs: list) -> list:
+    """推論（CPU想定）。複数枚はまとめて1回の呼び出しでバッチ推論する"""
+    predictor = model.predictor
+    with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=USE_BF16):
+        if predictor is None:
+            # 初回（INIT のウォームアップ）だけ通常経路で predictor を組み立てる
+            return model(np_imgs, imgsz=IMGSZ, verbose=False)
+        # 2回目以降は predict() の毎回のセットアップ（引数の再構築・ソースの判定・
+        # ストリーム処理）を飛ばし、前処理 → 推論 → 後処理だけを直接呼ぶ。
+        # 引数は初回と同じなので predictor.args / imgsz はそのまま使える
+        im = predictor.preprocess(np_imgs)
+        preds = predictor.inference(im)
+        # postprocess が参照する (paths, im0s, s)
+        predictor.batch = ([""] * len(np_imgs), np_imgs, [""] * len(np_imgs))
+        return predictor.postprocess(preds, im, np_imgs)
+
+
+def _compile_predictor_model():
+    """predictor が包んでいる nn.Module を torch.compile 版に差し替える"""
+    backend = model.predictor.model  # AutoBackend
+    # 入力サイズは IMGSZ 固定なので dynamic=False（形が変わると再コンパイルになる）
+    backend.model = torch.compile(backend.model, mode=TORCH_COMPILE_MODE, fullgraph=False, dynamic=False)
+
+
+# 初期化時にダミー画像で1回推論し、predictor の構築とカーネル選択を済ませておく
+# torch.compile は predictor を作ってから差し替え、もう1回流してコンパイルを済ませる
+try:
+    _predict([np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8)])
+    if TORCH_COMPILE and MODEL_PATH.endswith(".pt"):
+        _compile_predictor_model()
+        _predict([np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8)])
+except Exception as e:
+    print(f"Warmup failed: {str(e)}")
+
+
 def _segment_to_rgba_png(image_bytes: bytes) -> bytes:
     """
     YOLO segmentationでマスクを作り、背景透過PNG(bytes)を返す。
     ここでは「最も面積が大きいマスク」を採用（複数なら合成も可能）。
     """
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    w, h = img.size
-    np_img = np.array(img)
+    img, np_img = _decode_image(image_bytes)
+    return _result_to_rgba_png(img, np_img, _predict([_model_input(np_img)])[0])
 
-    # 推論（CPU想定）
-    results = model(np_img, verbose=False)
-    r0 = results[0]
+
+def _result_to_rgba_png(img, np_img, r0) -> bytes:
+    """推論結果1件から背景透過PNG(bytes)を作る"""
+    w, h = img.size
 
     if r0.masks is None or r0.boxes is None or len(r0.boxes) == 0:
         # 何も検出できない場合：そのまま不透明で返すか、全透明で返すか選べる
         # ここでは「そのまま(不透明)」で返す
         rgba = img.convert("RGBA")
         out = io.BytesIO()
-        rgba.save(out, format="PNG")
+        rgba.save(out, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
         return out.getvalue()
 
-    # mask: (n, mask_h, mask_w) float tensor -> numpy
-    masks = r0.masks.data.cpu().numpy()  # shape: (N, mh, mw)
-    # スコア
-    scores = r0.boxes.conf.cpu().numpy()  # (N,)
-
-    # マスクを元画像サイズにリサイズして、最大面積（or スコア最大）を選ぶ
-    best_idx = int(np.argmax(scores))
-    best_mask = masks[best_idx]
+    # スコア最大のインスタンスをテンソルのまま選び、その1枚だけ numpy にする
+    # （N 枚全部の (N, mh, mw) を転送しない）
+    best_idx = int(r0.boxes.conf.argmax())
+    # BF16 のままだと numpy に変換できないので float32 に戻す
+    best_mask = r0.masks.data[best_idx].float().cpu().numpy()  # shape: (mh, mw)
 
-    mask_img = Image.fromarray((best_mask * 255).astype(np.uint8), mode="L")
-    mask_img = mask_img.resize((w, h), resample=Image.BILINEAR)
+    alpha = (best_mask * 255).astype(np.uint8)
+    if alpha.shape != (h, w):
+        alpha = cv2.resize(alpha, (w, h), interpolation=cv2.INTER_LINEAR)
 
     # しきい値で2値化（必要なら）
-    alpha = np.array(mask_img)
-    print("Mask alpha stats:", alpha.min(), alpha.max(), alpha.mean())
     alpha = (alpha > 128).astype(np.uint8) * 255
-    
 
-    rgba = Image.fromarray(np.dstack([np_img, alpha]), mode="RGBA")
+    # RGBA を1回だけ確保して RGB とアルファを書き込む（dstack の中間コピーを作らない）
+    rgba_np = np.empty((h, w, 4), dtype=np.uint8)
+    rgba_np[:, :, :3] = np_img
+    rgba_np[:, :, 3] = alpha
+    rgba = Image.fromarray(rgba_np, mode="RGBA")
 
     out = io.BytesIO()
-    rgba.save(out, format="PNG")
+    rgba.save(out, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
     return out.getvalue()
 
 
-def _put_to_s3(png_bytes: bytes, bucket: str, key: str) -> str:
+def _put_object(png_bytes: bytes, bucket: str, key: str) -> None:
     s3.put_object(
         Bucket=bucket,
         Key=key,
@@ -119,17 +250,87 @@ def _put_to_s3(png_bytes: bytes, bucket: str, key: str) -> str:
         ContentType="image/png",
         CacheControl="public, max-age=31536000",
     )
+
+
+def _presign(bucket: str, key: str) -> str:
     # 返すURLは2択：
     # 1) 署名付きURL（安全・確実）
-    url = s3.generate_presigned_url(
+    return s3.generate_presigned_url(
         "get_object",
         Params={"Bucket": bucket, "Key": key},
         ExpiresIn=3600,
     )
+
+
+def _put_to_s3(png_bytes: bytes, bucket: str, key: str) -> str:
+    # PUT はスレッドに投げ、その間に（ネットワーク不要の）URL 署名を済ませる
+    put_future = _put_executor.submit(_put_object, png_bytes, bucket, key)
+    url = _presign(bucket, key)
+    # アップロード完了（と失敗時の例外）を待ってから URL を返す
+    put_future.result()
     return url
 
 
+def _process_sqs_item(payload: dict, img, np_img, r0) -> str:
+    # _put_executor のスレッドで動くので、PUT は入れ子で投げずにこのスレッドで直接行う
+    bucket = payload.get("bucket") or DEFAULT_BUCKET
+    if not bucket:
+        raise ValueError("BUCKET_NAME or bucket is missing")
+    s3_key = payload.get("s3Key") or f"cutouts/{uuid.uuid4().hex}.png"
+    _put_object(_result_to_rgba_png(img, np_img, r0), bucket, s3_key)
+    return _presign(bucket, s3_key)
+
+
+def _handle_sqs_batch(records: list) -> dict:
+    """
+    SQS から来た複数メッセージをまとめて処理する。
+    body は JSON の { "imageBase64": "...", "s3Key": "...", "bucket": "..." }。
+    推論は全件で1回、PNG 化と S3 PUT はスレッドで並列に行う。
+    失敗したメッセージだけ batchItemFailures で返す（ReportBatchItemFailures 用）。
+    """
+    failures = []
+    items = []
+    for record in records:
+        try:
+            payload = json.loads(record["body"])
+            image_b64 = payload.get("imageBase64")
+            if not image_b64:
+                raise ValueError("Missing imageBase64 in message body")
+            img, np_img = _decode_image(base64.b64decode(image_b64))
+            items.append((record["messageId"], payload, img, np_img))
+        except Exception as e:
+            print(f"Bad message {record.get('messageId')}: {str(e)}")
+            failures.append(record.get("messageId"))
+
+    results = []
+    if items:
+        try:
+            results = _predict([_model_input(np_img) for _, _, _, np_img in items])
+        except Exception as e:
+            print(f"Batch inference failed: {str(e)}")
+            failures.extend(message_id for message_id, _, _, _ in items)
+            items = []
+
+    if items:
+        futures = [
+            (message_id, _put_executor.submit(_process_sqs_item, payload, img, np_img, r0))
+            for (message_id, payload, img, np_img), r0 in zip(items, results)
+        ]
+        for message_id, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed message {message_id}: {str(e)}")
+                failures.append(message_id)
+
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
+
+
 def lambda_handler(event, context):
+    # SQS トリガー（複数レコードをまとめて推論）
+    if event.get("Records"):
+        return _handle_sqs_batch(event["Records"])
+
     try:
         img_bytes, s3_key = _read_request_bytes(event)
 
@@ -143,7 +344,6 @@ def lambda_handler(event, context):
             raise ValueError("BUCKET_NAME or x-s3-bucket is missing")
         # key が無ければ自動生成
         if not s3_key:
-            import uuid
             s3_key = f"cutouts/{uuid.uuid4().hex}.png"
 
         s3_url = _put_to_s3(out_png, bucket, s3_key)